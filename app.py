@@ -5,15 +5,47 @@ Main application file for the student performance analysis system
 
 import streamlit as st
 import os
+import hashlib
+import tempfile
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 from dotenv import load_dotenv
+import document_processor
+import gemini_analyzer
 from document_processor import DocumentProcessor
 from gemini_analyzer import GeminiAnalyzer
 from report_generator import ReportGenerator
 import traceback
 
+try:
+    import blake3
+except ImportError:  # Optional: fall back to hashlib's blake2b
+    blake3 = None
+
 # Load environment variables
 load_dotenv()
 
+# Gemini responses are cached here so identical requests are never sent twice
+RESPONSE_CACHE_PATH = os.getenv(
+    "GEMINI_RESPONSE_CACHE",
+    os.path.join(tempfile.gettempdir(), "gemini_response_cache.sqlite3")
+)
+
+# Cached analysis results are only valid for the code that produced them: any change
+# to the prompts, response parsing or page processing starts a fresh cache
+ANALYSIS_VERSION = hashlib.blake2b(
+    b"".join(Path(module.__file__).read_bytes() for module in (gemini_analyzer, document_processor)),
+    digest_size=16
+).hexdigest()
+ANALYSIS_CACHE_MAX_ENTRIES = 200  # Results held in memory
+ANALYSIS_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60  # Age at which persisted results are deleted
+
+# Generated reports are written here, one Excel/PDF pair per analysis
+REPORT_DIR = os.path.join(tempfile.gettempdir(), "student_reports")
+REPORT_TTL_SECONDS = 60 * 60
+
 # Page configuration
 st.set_page_config(
     page_title="Student Performance Analyzer",
@@ -22,8 +54,7 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
-    <style>
+CUSTOM_CSS = """
     .main-header {
         font-size: 2.5rem;
         font-weight: bold;
@@ -59,8 +90,252 @@ st.markdown("""
         border-radius: 5px;
         margin: 1rem 0;
     }
-    </style>
-""", unsafe_allow_html=True)
+"""
+
+# Streamlit drops any element a rerun doesn't re-emit, so the stylesheet has to be sent
+# on every run; build the compact markup once at import instead of per rerun
+CUSTOM_CSS_MARKUP = f"<style>{' '.join(CUSTOM_CSS.split())}</style>"
+
+def inject_custom_css():
+    """Inject the app stylesheet"""
+    st.markdown(CUSTOM_CSS_MARKUP, unsafe_allow_html=True)
+
+def _file_digest(file_bytes: bytes) -> str:
+    """Compute a content hash used as the cache key for uploaded files"""
+    if blake3 is not None:
+        return blake3.blake3(file_bytes, max_threads=blake3.blake3.AUTO).hexdigest()
+    return hashlib.blake2b(file_bytes).hexdigest()
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def _process_file_cached(file_hash: str, name: str, file_type: str, _file_bytes: bytes):
+    """Convert an uploaded file to images, memoized on its content hash"""
+    return DocumentProcessor.process_bytes(_file_bytes, file_type)
+
+def hash_uploads(uploaded_files) -> list:
+    """Pair each uploaded file with its content hash, computed once per analysis run"""
+    return [(uploaded_file, _file_digest(uploaded_file.getvalue())) for uploaded_file in uploaded_files]
+
+def process_upload(hashed_upload: tuple):
+    """Process a single (uploaded file, hash) pair, reusing cached output for unchanged uploads"""
+    uploaded_file, file_hash = hashed_upload
+    return _process_file_cached(
+        file_hash,
+        uploaded_file.name,
+        uploaded_file.type,
+        uploaded_file.getvalue()
+    )
+
+def process_uploads(hashed_uploads: list) -> list:
+    """Process several hashed uploads concurrently, preserving upload order"""
+    if not hashed_uploads:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(hashed_uploads))) as executor:
+        return list(chain.from_iterable(executor.map(process_upload, hashed_uploads)))
+
+@st.cache_resource(show_spinner=False)
+def get_analyzer(api_key: str, model_name: str) -> GeminiAnalyzer:
+    """Create the Gemini analyzer once per API key and model and reuse it across reruns"""
+    return GeminiAnalyzer(api_key, model_name=model_name, cache_path=RESPONSE_CACHE_PATH)
+
+def files_digest(hashed_uploads: list) -> str:
+    """Combine the content hashes of a group of hashed uploads, in upload order"""
+    key = hashlib.blake2b()
+    for _, file_hash in hashed_uploads:
+        key.update(file_hash.encode())
+    return key.hexdigest()
+
+def analysis_cache_key(model_name: str, *hashed_groups) -> str:
+    """
+    Build a cache key from the analysis code version, the model name and the
+    content hash of every uploaded file
+    """
+    key = hashlib.blake2b(ANALYSIS_VERSION.encode())
+    key.update(model_name.encode())
+    for hashed_uploads in hashed_groups:
+        key.update(files_digest(hashed_uploads).encode())
+    return key.hexdigest()
+
+@st.cache_resource(ttl=47 * 60 * 60, show_spinner=False)
+def upload_document_images(api_key: str, files_key: str, _analyzer: GeminiAnalyzer, _images: list) -> list:
+    """Upload a document's images to Gemini once; files expire server-side after 48 hours"""
+    return _analyzer.upload_images(_images)
+
+@st.cache_data(persist="disk", max_entries=ANALYSIS_CACHE_MAX_ENTRIES, show_spinner=False)
+def _analysis_results_cache(cache_key: str, _results=None):
+    """
+    Disk-persisted store of analysis results keyed on analysis_cache_key().
+    Called with only a key it raises KeyError on a miss (exceptions are never
+    cached); called with results it stores them under that key.
+    """
+    if _results is None:
+        raise KeyError(cache_key)
+    return _results
+
+@st.cache_resource(ttl=24 * 60 * 60, show_spinner=False)
+def _prune_persisted_results():
+    """
+    Delete disk-persisted results older than ANALYSIS_CACHE_MAX_AGE_SECONDS; runs at
+    most once a day. Streamlit never evicts persisted entries itself (max_entries only
+    bounds memory), and _analysis_results_cache is this app's only persisted cache.
+    """
+    cache_dir = Path.home() / ".streamlit" / "cache"
+    cutoff = time.time() - ANALYSIS_CACHE_MAX_AGE_SECONDS
+    for memo_file in cache_dir.glob("*.memo"):
+        try:
+            if memo_file.stat().st_mtime < cutoff:
+                memo_file.unlink()
+        except OSError:
+            pass  # Already removed by another session
+
+def _write_report_file(data: bytes, path: str) -> str:
+    """Write report bytes to path atomically, so a download never reads a partial file"""
+    with tempfile.NamedTemporaryFile(dir=REPORT_DIR, prefix=".tmp_", delete=False) as report_file:
+        report_file.write(data)
+    os.replace(report_file.name, path)
+    return path
+
+def _prune_report_files(max_age: float):
+    """Delete files in REPORT_DIR that haven't been written for max_age seconds"""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(REPORT_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass  # Already removed by another session
+
+def _write_reports(cache_key: str, results: list) -> tuple:
+    """
+    Write an analysis's Excel and PDF reports to REPORT_DIR and return their paths.
+    Files are named after the cache key, so rewriting an analysis replaces its
+    previous pair, and files older than twice the TTL (long after their cache entry
+    expired) are deleted, keeping REPORT_DIR bounded on a long-running server.
+    """
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    _prune_report_files(2 * REPORT_TTL_SECONDS)
+    (excel_data, _), (pdf_data, _) = ReportGenerator.create_downloadable_reports(results)
+    report_base = os.path.join(REPORT_DIR, cache_key)
+    return (
+        _write_report_file(excel_data, report_base + ".xlsx"),
+        _write_report_file(pdf_data, report_base + ".pdf")
+    )
+
+@st.cache_data(ttl=REPORT_TTL_SECONDS, show_spinner=False)
+def build_reports(cache_key: str, _results: list) -> tuple:
+    """
+    Generate the Excel and PDF reports once per analysis, keyed like the results cache.
+    The reports are spooled to disk and only their paths are returned, so neither
+    the cache nor session state holds the report bytes.
+    """
+    return _write_reports(cache_key, _results)
+
+def run_analysis(api_key: str, model_name: str, analysis_sheets, question_papers, answer_sheets,
+                 progress_bar, status_text) -> list:
+    """
+    Convert the uploads to images and run the concept-wise Gemini analysis.
+    Each document group is a list of (uploaded file, hash) pairs from hash_uploads.
+    """
+    # Process documents (handle multiple files)
+    status_text.text("Processing documents...")
+    progress_bar.progress(10)
+    
+    # The three document types are independent, so convert them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        analysis_future = executor.submit(process_uploads, analysis_sheets)
+        question_future = executor.submit(process_uploads, question_papers)
+        answer_future = executor.submit(process_uploads, answer_sheets)
+    
+        stage_futures = [analysis_future, question_future, answer_future]
+        for completed, _ in enumerate(as_completed(stage_futures), 1):
+            progress_bar.progress(10 + completed * 10)
+    
+    analysis_images = analysis_future.result()
+    question_images = question_future.result()
+    answer_images = answer_future.result()
+    
+    status_text.text("Documents processed successfully")
+    
+    # Initialize Gemini analyzer
+    status_text.text("Initializing AI model...")
+    analyzer = get_analyzer(api_key, model_name)
+    progress_bar.progress(50)
+    
+    # Question paper and answer sheet go into every per-concept prompt, so upload them once
+    status_text.text("Uploading documents to Gemini...")
+    question_files = upload_document_images(api_key, files_digest(question_papers), analyzer, question_images)
+    answer_files = upload_document_images(api_key, files_digest(answer_sheets), analyzer, answer_images)
+    
+    # Define progress callback
+    def update_progress(message):
+        status_text.text(f"{message}")
+    
+    # Perform analysis, showing each concept's result as soon as Gemini returns it
+    status_text.text("Analyzing performance (this may take a few minutes)...")
+    results = []
+    live_results = st.empty()
+    with live_results.container():
+        for idx, result in enumerate(analyzer.iter_analyze_concepts(
+            analysis_images,
+            question_files,
+            answer_files,
+            progress_callback=update_progress,
+            use_context_cache=True
+        ), 1):
+            render_concept_result(idx, result, lazy=False)
+            results.append(result)
+    
+    # The full results section below replaces the live preview
+    live_results.empty()
+    return results
+
+def summarize_results(results: list) -> dict:
+    """Compute the summary metrics for a set of concept results in a single pass"""
+    tested_concepts = 0
+    total_mistakes = 0
+    for result in results:
+        tested_concepts += result["tested_count"] > 0
+        total_mistakes += result["mistakes_count"]
+    return {
+        "total_concepts": len(results),
+        "tested_concepts": tested_concepts,
+        "total_mistakes": total_mistakes
+    }
+
+def format_result(result: dict) -> tuple:
+    """Format a result's summary text and, if it has mistakes, its mistake details"""
+    response_2 = GeminiAnalyzer.format_response_2(result) if result["mistakes_count"] > 0 else None
+    return GeminiAnalyzer.format_response_1(result), response_2
+
+def format_results(results: list) -> list:
+    """Format every result once per analysis so reruns only read the stored strings"""
+    return [format_result(result) for result in results]
+
+# (widget key, title, caption) for each document uploader, in column order
+UPLOADER_SPECS = [
+    ("analysis_sheet", "Analysis Sheet", "Upload the concept list (can upload multiple files)"),
+    ("question_paper", "Question Paper", "Upload the exam questions (can upload multiple files)"),
+    ("answer_sheet", "Answer Sheet", "Upload student's solutions (can upload multiple files)"),
+]
+
+def render_uploaders(specs: list) -> dict:
+    """Render one uploader column per spec and return the uploaded files by widget key"""
+    uploads = {}
+    for column, (key, title, caption) in zip(st.columns(len(specs)), specs):
+        with column:
+            st.markdown('<div class="upload-section">', unsafe_allow_html=True)
+            st.markdown(f"**{title}**")
+            st.caption(caption)
+            uploads[key] = st.file_uploader(
+                title,
+                type=["png", "jpg", "jpeg", "pdf"],
+                key=key,
+                label_visibility="collapsed",
+                accept_multiple_files=True
+            )
+            if uploads[key]:
+                st.success(f"{len(uploads[key])} file(s) uploaded")
+            st.markdown('</div>', unsafe_allow_html=True)
+    return uploads
 
 def initialize_session_state():
     """Initialize session state variables"""
@@ -68,14 +343,137 @@ def initialize_session_state():
         st.session_state.analysis_complete = False
     if 'results' not in st.session_state:
         st.session_state.results = None
-    if 'excel_data' not in st.session_state:
-        st.session_state.excel_data = None
-    if 'pdf_data' not in st.session_state:
-        st.session_state.pdf_data = None
+    if 'summary' not in st.session_state:
+        st.session_state.summary = None
+    if 'formatted' not in st.session_state:
+        st.session_state.formatted = None
+    if 'excel_path' not in st.session_state:
+        st.session_state.excel_path = None
+    if 'pdf_path' not in st.session_state:
+        st.session_state.pdf_path = None
+
+def _open_concept(open_key: str):
+    """Remember that the user asked to see a concept's details"""
+    st.session_state[open_key] = True
+
+def _reset_opened_concepts():
+    """Forget which concept bodies were opened for a previous set of results"""
+    for key in [key for key in st.session_state if str(key).startswith("concept_open_")]:
+        del st.session_state[key]
+
+@st.fragment
+def render_concept_result(idx: int, result: dict, formatted: tuple = None, lazy: bool = True):
+    """
+    Render one concept's expander as a fragment so it reruns independently.
+    With lazy=True the body is only built once the user asks for it, so
+    collapsed expanders don't ship their markdown to the browser.
+    formatted is the (response_1, response_2) pair from format_results().
+    """
+    open_key = f"concept_open_{idx}"
+    is_open = st.session_state.get(open_key, False)
+    with st.expander(
+        f"{idx}. {result['concept']} - {result['tested_count']} questions, {result['mistakes_count']} mistakes",
+        expanded=lazy and is_open
+    ):
+        if lazy and not is_open:
+            st.button("Show analysis", key=f"show_concept_{idx}", on_click=_open_concept, args=(open_key,))
+        else:
+            _render_concept_body(result, formatted or format_result(result))
+
+def _render_concept_body(result: dict, formatted: tuple):
+    """Render the performance summary and Gemini reasoning for one concept"""
+    response_1, response_2 = formatted
+    st.markdown("**Performance Summary:**")
+    st.write(response_1)
+    
+    # Show concept reasoning (how Gemini mapped questions to this concept)
+    if result.get("concept_reasoning"):
+        st.markdown("---")
+        st.markdown("**How Gemini Mapped Questions to This Concept:**")
+        for reasoning in result["concept_reasoning"]:
+            q_num = reasoning.get("question", "?")
+            summary = reasoning.get("summary", "")
+            confidence = reasoning.get("confidence", "medium")
+            
+            st.markdown(f"**Question {q_num}** *({confidence} confidence)*")
+            st.caption(summary)
+            
+            # Show concept alignments
+            alignments = reasoning.get("concept_alignments", [])
+            for alignment in alignments:
+                if alignment.get("concept") == result["concept"]:
+                    st.info(f"**Rationale:** {alignment.get('rationale', 'N/A')}")
+            
+            # Show rejected concepts if any
+            rejected = reasoning.get("considered_but_rejected", [])
+            if rejected:
+                st.caption(f"Also considered but rejected: {', '.join(rejected)}")
+    
+    if result["mistakes_count"] > 0:
+        st.markdown("---")
+        st.markdown("**Detailed Mistake Analysis:**")
+        st.write(response_2)
+        
+        # Show performance reasoning (how Gemini evaluated the student's answers)
+        if result.get("performance_reasoning"):
+            st.markdown("---")
+            st.markdown("**How Gemini Evaluated Each Answer:**")
+            for perf_reasoning in result["performance_reasoning"]:
+                q_num = perf_reasoning.get("question", "?")
+                observation = perf_reasoning.get("observation", "")
+                concept_eval = perf_reasoning.get("concept_evaluation", "")
+                conclusion = perf_reasoning.get("conclusion", "")
+                confidence = perf_reasoning.get("confidence", "medium")
+                
+                with st.container():
+                    st.markdown(f"**Question {q_num}** *({confidence} confidence)*")
+                    st.markdown(f"**Observation:** {observation}")
+                    st.markdown(f"**Concept Application:** {concept_eval}")
+                    st.markdown(f"**Conclusion:** {conclusion}")
+                    st.markdown("")
+    
+    # Show evaluation notes if any
+    if result.get("performance_notes"):
+        st.markdown("---")
+        st.markdown("**Additional Evaluation Notes:**")
+        for note in result["performance_notes"]:
+            st.info(note)
+
+@st.fragment
+def render_downloads():
+    """Render the report download buttons; clicking one reruns only this fragment"""
+    excel_path, pdf_path = st.session_state.excel_path, st.session_state.pdf_path
+    if not (os.path.exists(excel_path) and os.path.exists(pdf_path)):
+        # Pruned while this session sat idle; files are named after their cache key
+        excel_path, pdf_path = _write_reports(Path(excel_path).stem, st.session_state.results)
+        st.session_state.excel_path = excel_path
+        st.session_state.pdf_path = pdf_path
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.download_button(
+            label="Download Excel Report",
+            data=Path(excel_path).read_bytes,  # Read only when clicked
+            file_name="student_performance_analysis.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+    
+    with col2:
+        st.download_button(
+            label="Download PDF Report",
+            data=Path(pdf_path).read_bytes,  # Read only when clicked
+            file_name="student_performance_analysis.pdf",
+            mime="application/pdf",
+            use_container_width=True
+        )
 
 def main():
     """Main application function"""
+    inject_custom_css()
     initialize_session_state()
+    _prune_persisted_results()
     
     # Header
     st.markdown('<div class="main-header">Student Performance Analyzer</div>', unsafe_allow_html=True)
@@ -118,52 +516,10 @@ def main():
     st.markdown("### Upload Documents")
     
     # File uploaders in columns
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.markdown('<div class="upload-section">', unsafe_allow_html=True)
-        st.markdown("**Analysis Sheet**")
-        st.caption("Upload the concept list (can upload multiple files)")
-        analysis_sheets = st.file_uploader(
-            "Analysis Sheet",
-            type=["png", "jpg", "jpeg", "pdf"],
-            key="analysis_sheet",
-            label_visibility="collapsed",
-            accept_multiple_files=True
-        )
-        if analysis_sheets:
-            st.success(f"{len(analysis_sheets)} file(s) uploaded")
-        st.markdown('</div>', unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown('<div class="upload-section">', unsafe_allow_html=True)
-        st.markdown("**Question Paper**")
-        st.caption("Upload the exam questions (can upload multiple files)")
-        question_papers = st.file_uploader(
-            "Question Paper",
-            type=["png", "jpg", "jpeg", "pdf"],
-            key="question_paper",
-            label_visibility="collapsed",
-            accept_multiple_files=True
-        )
-        if question_papers:
-            st.success(f"{len(question_papers)} file(s) uploaded")
-        st.markdown('</div>', unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown('<div class="upload-section">', unsafe_allow_html=True)
-        st.markdown("**Answer Sheet**")
-        st.caption("Upload student's solutions (can upload multiple files)")
-        answer_sheets = st.file_uploader(
-            "Answer Sheet",
-            type=["png", "jpg", "jpeg", "pdf"],
-            key="answer_sheet",
-            label_visibility="collapsed",
-            accept_multiple_files=True
-        )
-        if answer_sheets:
-            st.success(f"{len(answer_sheets)} file(s) uploaded")
-        st.markdown('</div>', unsafe_allow_html=True)
+    uploads = render_uploaders(UPLOADER_SPECS)
+    analysis_sheets = uploads["analysis_sheet"]
+    question_papers = uploads["question_paper"]
+    answer_sheets = uploads["answer_sheet"]
     
     st.markdown("---")
     
@@ -196,59 +552,40 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                # Initialize document processor
-                processor = DocumentProcessor()
-                
-                # Process documents (handle multiple files)
-                status_text.text("Processing documents...")
-                progress_bar.progress(10)
-                
-                analysis_images = []
-                for file in analysis_sheets:
-                    analysis_images.extend(processor.process_uploaded_file(file))
-                progress_bar.progress(20)
-                
-                question_images = []
-                for file in question_papers:
-                    question_images.extend(processor.process_uploaded_file(file))
-                progress_bar.progress(30)
-                
-                answer_images = []
-                for file in answer_sheets:
-                    answer_images.extend(processor.process_uploaded_file(file))
-                progress_bar.progress(40)
-                
-                status_text.text("Documents processed successfully")
-                
-                # Initialize Gemini analyzer
-                status_text.text("Initializing AI model...")
-                analyzer = GeminiAnalyzer(api_key, model_name=model_choice)
-                progress_bar.progress(50)
+                # Hash every upload once; the cache keys below all derive from these
+                hashed_groups = [
+                    hash_uploads(uploaded_files)
+                    for uploaded_files in (analysis_sheets, question_papers, answer_sheets)
+                ]
                 
-                # Define progress callback
-                def update_progress(message):
-                    status_text.text(f"{message}")
-                
-                # Perform analysis
-                status_text.text("Analyzing performance (this may take a few minutes)...")
-                results = analyzer.analyze_all_concepts(
-                    analysis_images,
-                    question_images,
-                    answer_images,
-                    progress_callback=update_progress
-                )
+                # Reuse a previous analysis of identical documents with the same model
+                cache_key = analysis_cache_key(model_choice, *hashed_groups)
+                try:
+                    results = _analysis_results_cache(cache_key)
+                    status_text.text("Reusing previous analysis of these documents...")
+                except KeyError:
+                    results = run_analysis(
+                        api_key,
+                        model_choice,
+                        *hashed_groups,
+                        progress_bar,
+                        status_text
+                    )
+                    _analysis_results_cache(cache_key, _results=results)
                 progress_bar.progress(90)
                 
                 # Generate reports
                 status_text.text("Generating reports...")
-                excel_data, _ = ReportGenerator.create_downloadable_excel(results)
-                pdf_data, _ = ReportGenerator.create_downloadable_pdf(results)
+                excel_path, pdf_path = build_reports(cache_key, results)
                 progress_bar.progress(100)
                 
                 # Store results in session state
                 st.session_state.results = results
-                st.session_state.excel_data = excel_data
-                st.session_state.pdf_data = pdf_data
+                st.session_state.summary = summarize_results(results)
+                st.session_state.formatted = format_results(results)
+                _reset_opened_concepts()
+                st.session_state.excel_path = excel_path
+                st.session_state.pdf_path = pdf_path
                 st.session_state.analysis_complete = True
                 
                 status_text.text("Analysis complete!")
@@ -267,104 +604,28 @@ def main():
         st.markdown("---")
         st.markdown("### Analysis Results")
         
-        # Summary statistics
+        # Summary statistics (computed once when the analysis finished)
         results = st.session_state.results
-        total_concepts = len(results)
-        tested_concepts = sum(1 for r in results if r["tested_count"] > 0)
-        total_mistakes = sum(r["mistakes_count"] for r in results)
+        summary = st.session_state.summary
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Total Concepts", total_concepts)
+            st.metric("Total Concepts", summary["total_concepts"])
         with col2:
-            st.metric("Concepts Tested", tested_concepts)
+            st.metric("Concepts Tested", summary["tested_concepts"])
         with col3:
-            st.metric("Total Mistakes", total_mistakes)
+            st.metric("Total Mistakes", summary["total_mistakes"])
         
         # Detailed results in expandable sections
         st.markdown("### Detailed Analysis by Concept")
         
-        for idx, result in enumerate(results, 1):
-            with st.expander(f"{idx}. {result['concept']} - {result['tested_count']} questions, {result['mistakes_count']} mistakes"):
-                st.markdown("**Performance Summary:**")
-                st.write(GeminiAnalyzer.format_response_1(result))
-                
-                # Show concept reasoning (how Gemini mapped questions to this concept)
-                if result.get("concept_reasoning"):
-                    st.markdown("---")
-                    st.markdown("**How Gemini Mapped Questions to This Concept:**")
-                    for reasoning in result["concept_reasoning"]:
-                        q_num = reasoning.get("question", "?")
-                        summary = reasoning.get("summary", "")
-                        confidence = reasoning.get("confidence", "medium")
-                        
-                        st.markdown(f"**Question {q_num}** *({confidence} confidence)*")
-                        st.caption(summary)
-                        
-                        # Show concept alignments
-                        alignments = reasoning.get("concept_alignments", [])
-                        for alignment in alignments:
-                            if alignment.get("concept") == result["concept"]:
-                                st.info(f"**Rationale:** {alignment.get('rationale', 'N/A')}")
-                        
-                        # Show rejected concepts if any
-                        rejected = reasoning.get("considered_but_rejected", [])
-                        if rejected:
-                            st.caption(f"Also considered but rejected: {', '.join(rejected)}")
-                
-                if result["mistakes_count"] > 0:
-                    st.markdown("---")
-                    st.markdown("**Detailed Mistake Analysis:**")
-                    st.write(GeminiAnalyzer.format_response_2(result))
-                    
-                    # Show performance reasoning (how Gemini evaluated the student's answers)
-                    if result.get("performance_reasoning"):
-                        st.markdown("---")
-                        st.markdown("**How Gemini Evaluated Each Answer:**")
-                        for perf_reasoning in result["performance_reasoning"]:
-                            q_num = perf_reasoning.get("question", "?")
-                            observation = perf_reasoning.get("observation", "")
-                            concept_eval = perf_reasoning.get("concept_evaluation", "")
-                            conclusion = perf_reasoning.get("conclusion", "")
-                            confidence = perf_reasoning.get("confidence", "medium")
-                            
-                            with st.container():
-                                st.markdown(f"**Question {q_num}** *({confidence} confidence)*")
-                                st.markdown(f"**Observation:** {observation}")
-                                st.markdown(f"**Concept Application:** {concept_eval}")
-                                st.markdown(f"**Conclusion:** {conclusion}")
-                                st.markdown("")
-                
-                # Show evaluation notes if any
-                if result.get("performance_notes"):
-                    st.markdown("---")
-                    st.markdown("**Additional Evaluation Notes:**")
-                    for note in result["performance_notes"]:
-                        st.info(note)
+        for idx, (result, formatted) in enumerate(zip(results, st.session_state.formatted), 1):
+            render_concept_result(idx, result, formatted)
         
         # Download buttons
         st.markdown("---")
         st.markdown("### Download Reports")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.download_button(
-                label="Download Excel Report",
-                data=st.session_state.excel_data,
-                file_name="student_performance_analysis.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
-        
-        with col2:
-            st.download_button(
-                label="Download PDF Report",
-                data=st.session_state.pdf_data,
-                file_name="student_performance_analysis.pdf",
-                mime="application/pdf",
-                use_container_width=True
-            )
+        render_downloads()
 
 if __name__ == "__main__":
     main()
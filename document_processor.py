@@ -4,18 +4,42 @@ Handles conversion of uploaded images and PDFs to formats suitable for Gemini AP
 """
 
 import io
-import base64
-from PIL import Image
-from pdf2image import convert_from_bytes
+import os
+import mimetypes
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageFile
+from pdf2image import convert_from_path
 from pypdf import PdfReader
-from typing import List, Tuple, Union
-import streamlit as st
+from typing import Iterator, List, Optional, Union
+
+
+# Let Pillow's encoders write each page in a few large blocks rather than 64 KB chunks
+ImageFile.MAXBLOCK = max(ImageFile.MAXBLOCK, 4 * 1024 * 1024)
 
 
 class DocumentProcessor:
     """Process images and PDFs for Gemini API consumption"""
     
     MAX_IMAGE_SIZE = (1024, 1024)  # Max dimensions for optimization
+    JPEG_QUALITY = 85  # Keeps handwriting legible at a fraction of PNG's size
+    JPEG_MODES = ('RGB', 'L')  # Modes JPEG can store without losing transparency
+    RESIZE_REDUCING_GAP = 2.0  # Box-reduce until within 2x of the target, then Lanczos
+    COPY_BUFFER_SIZE = 1 << 20  # Chunk size when spooling uploads to disk
+    MIN_PDF_PAGE_TEXT = 200  # Characters per page below which a PDF is treated as scanned
+    # Send born-digital PDFs as their text layer alone. Off by default: pypdf text drops
+    # figures and garbles integrals, fractions and superscripts in maths papers.
+    PDF_TEXT_ONLY = False
+    IMAGE_TYPES = frozenset({'image/jpeg', 'image/jpg', 'image/png', 'image/webp'})
+    RENDER_PROCESSES = min(4, os.cpu_count() or 1)  # pdftoppm processes per PDF
+    # Shared by every PDF converted at once (the app processes several uploads
+    # concurrently), keeping the totals at about one render process and one decode
+    # thread per CPU
+    _render_slots = threading.BoundedSemaphore(max(1, (os.cpu_count() or 1) // RENDER_PROCESSES))
+    _decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="pdf-decode")
     
     @staticmethod
     def optimize_image(image: Image.Image) -> Image.Image:
@@ -28,18 +52,27 @@ class DocumentProcessor:
         Returns:
             Optimized PIL Image object
         """
-        # Convert RGBA to RGB if necessary
-        if image.mode == 'RGBA':
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            background.paste(image, mask=image.split()[3])
-            image = background
-        elif image.mode != 'RGB':
+        # Palette and other exotic modes can't be resampled smoothly; flatten them first
+        if image.mode not in ('RGB', 'RGBA', 'L'):
             image = image.convert('RGB')
         
-        # Resize if image is too large
+        # Resize if image is too large. Doing this before the RGB conversion keeps that
+        # work on the small image and lets JPEG sources decode at reduced scale (draft);
+        # the integer box reduce leaves only the last <2x step to Lanczos.
         if image.size[0] > DocumentProcessor.MAX_IMAGE_SIZE[0] or \
            image.size[1] > DocumentProcessor.MAX_IMAGE_SIZE[1]:
-            image.thumbnail(DocumentProcessor.MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+            image.thumbnail(
+                DocumentProcessor.MAX_IMAGE_SIZE,
+                Image.Resampling.LANCZOS,
+                reducing_gap=DocumentProcessor.RESIZE_REDUCING_GAP
+            )
+        
+        # Convert RGBA to RGB if necessary, flattening onto white in a single composite pass
+        if image.mode == 'RGBA':
+            background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image).convert('RGB')
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
         
         return image
     
@@ -49,7 +82,7 @@ class DocumentProcessor:
         Process an uploaded image file
         
         Args:
-            uploaded_file: Streamlit UploadedFile object
+            uploaded_file: Streamlit UploadedFile object or path to an image on disk
             
         Returns:
             List of PIL Image objects
@@ -57,77 +90,196 @@ class DocumentProcessor:
         try:
             image = Image.open(uploaded_file)
             optimized_image = DocumentProcessor.optimize_image(image)
+            # Small RGB images come back still lazily opened; decode them once here
+            # (after optimizing, so large JPEGs can still use draft-mode decoding)
+            optimized_image.load()
             return [optimized_image]
         except Exception as e:
             raise ValueError(f"Error processing image: {str(e)}")
     
     @staticmethod
-    def process_pdf_file(uploaded_file) -> List[Image.Image]:
+    def process_pdf_file(uploaded_file, text_only: Optional[bool] = None) -> List[Union[Image.Image, str]]:
         """
         Process an uploaded PDF file and convert to images
         
+        With text_only, born-digital PDFs whose every page has a text layer are
+        returned as page text instead, skipping rasterization; scanned PDFs are
+        always rendered.
+        
         Args:
-            uploaded_file: Streamlit UploadedFile object
+            uploaded_file: Streamlit UploadedFile object or path to a PDF on disk
+            text_only: Return page text where available; defaults to PDF_TEXT_ONLY
             
         Returns:
-            List of PIL Image objects (one per page)
+            List of PIL Image objects (one per page), or of page text strings
         """
+        if text_only is None:
+            text_only = DocumentProcessor.PDF_TEXT_ONLY
         try:
-            # Read PDF bytes
-            pdf_bytes = uploaded_file.read()
-            uploaded_file.seek(0)  # Reset file pointer
+            if text_only:
+                text_pages = DocumentProcessor.extract_pdf_text(uploaded_file)
+                if text_pages is not None:
+                    return text_pages
+            return list(DocumentProcessor.iter_pdf_pages(uploaded_file))
+        except Exception as e:
+            raise ValueError(f"Error processing PDF: {str(e)}")
+    
+    @staticmethod
+    def extract_pdf_text(uploaded_file) -> Optional[List[str]]:
+        """
+        Extract the text layer of a PDF, if every page has a usable one
+        
+        Args:
+            uploaded_file: Streamlit UploadedFile object or path to a PDF on disk
             
-            # Convert PDF pages to images
-            images = convert_from_bytes(
-                pdf_bytes,
-                dpi=200,  # Good quality for text recognition
-                fmt='PNG'
-            )
+        Returns:
+            One labelled text string per page, or None if any page has too little
+            text (e.g. a scan) and the PDF needs to be rasterized instead
+        """
+        is_path = isinstance(uploaded_file, (str, os.PathLike))
+        try:
+            reader = PdfReader(uploaded_file)
+            texts = [page.extract_text() or "" for page in reader.pages]
+        except Exception:
+            # Leave anything pypdf can't parse to poppler
+            return None
+        finally:
+            if not is_path:
+                uploaded_file.seek(0)  # Reset file pointer for rasterization
+        
+        if not texts or any(len(text.strip()) < DocumentProcessor.MIN_PDF_PAGE_TEXT for text in texts):
+            return None
+        return [f"[Page {number} text]\n{text.strip()}" for number, text in enumerate(texts, 1)]
+    
+    @staticmethod
+    def iter_pdf_pages(uploaded_file) -> Iterator[Image.Image]:
+        """
+        Render a PDF and yield its optimized pages one at a time
+        
+        Pages are rendered to a temporary folder and decoded from there by the shared
+        decode pool, so only the pages in flight are held in memory as raw decodes.
+        
+        Args:
+            uploaded_file: Streamlit UploadedFile object or path to a PDF on disk
             
-            # Optimize each image
-            optimized_images = [DocumentProcessor.optimize_image(img) for img in images]
+        Yields:
+            Optimized PIL Image objects, in page order
+        """
+        with tempfile.TemporaryDirectory() as output_folder:
+            # Have poppler render straight at the target size (longest side) rather than
+            # at 200 DPI only to downscale afterwards, splitting pages across processes.
+            # Pages are written as lossless PPM, so the only lossy step is the JPEG_QUALITY
+            # encode in prepare_for_gemini.
+            render_options = {
+                'size': max(DocumentProcessor.MAX_IMAGE_SIZE),
+                'fmt': 'ppm',
+                'thread_count': DocumentProcessor.RENDER_PROCESSES,
+                'output_folder': output_folder,
+                'paths_only': True
+            }
             
-            return optimized_images
-        except Exception as e:
-            raise ValueError(f"Error processing PDF: {str(e)}")
+            if isinstance(uploaded_file, (str, os.PathLike)):
+                # Let poppler read straight from disk instead of buffering the PDF
+                pdf_path = uploaded_file
+            else:
+                # Spool the upload to disk in chunks rather than reading it into memory
+                pdf_path = os.path.join(output_folder, 'source.pdf')
+                with open(pdf_path, 'wb') as pdf_file:
+                    shutil.copyfileobj(uploaded_file, pdf_file, length=DocumentProcessor.COPY_BUFFER_SIZE)
+            
+            # Convert PDF pages to images, waiting for a render slot if other PDFs
+            # are being rendered
+            with DocumentProcessor._render_slots:
+                page_paths = convert_from_path(pdf_path, **render_options)
+            
+            # Decoding and resizing release the GIL, so pages are prepared in parallel
+            yield from DocumentProcessor._decode_pool.map(DocumentProcessor._load_pdf_page, page_paths)
+    
+    @staticmethod
+    def _load_pdf_page(page_path: str) -> Image.Image:
+        """Decode and optimize one rendered PDF page"""
+        page = Image.open(page_path)
+        page.load()  # Decode now; the rendered file is removed with the folder
+        return DocumentProcessor.optimize_image(page)
     
     @staticmethod
-    def process_uploaded_file(uploaded_file) -> List[Image.Image]:
+    def process_uploaded_file(uploaded_file) -> List[Union[Image.Image, str]]:
         """
         Process any uploaded file (image or PDF)
         
         Args:
-            uploaded_file: Streamlit UploadedFile object
+            uploaded_file: Streamlit UploadedFile object, or path to a file already
+                spooled to disk (MIME type is inferred from the file extension)
             
         Returns:
-            List of PIL Image objects
+            List of PIL Image objects (or page text for text-based PDFs, with PDF_TEXT_ONLY)
         """
         if uploaded_file is None:
             raise ValueError("No file uploaded")
         
-        file_type = uploaded_file.type
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            file_type, _ = mimetypes.guess_type(os.fspath(uploaded_file))
+            return DocumentProcessor._process_file_object(Path(uploaded_file), file_type)
         
-        if file_type in ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']:
-            return DocumentProcessor.process_image_file(uploaded_file)
+        return DocumentProcessor._process_file_object(uploaded_file, uploaded_file.type)
+    
+    @staticmethod
+    def process_bytes(file_bytes: bytes, file_type: str) -> List[Union[Image.Image, str]]:
+        """
+        Process raw file contents (image or PDF)
+        
+        Args:
+            file_bytes: Raw bytes of the uploaded file
+            file_type: MIME type of the file
+            
+        Returns:
+            List of PIL Image objects (or page text for text-based PDFs, with PDF_TEXT_ONLY)
+        """
+        return DocumentProcessor._process_file_object(io.BytesIO(file_bytes), file_type)
+    
+    @staticmethod
+    def _process_file_object(file_obj, file_type: str) -> List[Union[Image.Image, str]]:
+        """Dispatch a file-like object to the matching processor by MIME type"""
+        if file_type in DocumentProcessor.IMAGE_TYPES:
+            return DocumentProcessor.process_image_file(file_obj)
         elif file_type == 'application/pdf':
-            return DocumentProcessor.process_pdf_file(uploaded_file)
+            return DocumentProcessor.process_pdf_file(file_obj)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
     
     @staticmethod
-    def image_to_bytes(image: Image.Image) -> bytes:
+    def image_to_bytes(
+        image: Image.Image,
+        image_format: str = 'JPEG',
+        buffer: Optional[io.BytesIO] = None
+    ) -> bytes:
         """
         Convert PIL Image to bytes
         
         Args:
             image: PIL Image object
+            image_format: 'JPEG' (default) or 'PNG'
+            buffer: Optional scratch buffer to encode into, reused across calls
             
         Returns:
             Image bytes
         """
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+        if buffer is None:
+            img_byte_arr = io.BytesIO()
+        else:
+            img_byte_arr = buffer
+            img_byte_arr.seek(0)
+            img_byte_arr.truncate()
+        if image_format == 'JPEG':
+            image.save(
+                img_byte_arr,
+                format='JPEG',
+                quality=DocumentProcessor.JPEG_QUALITY,
+                optimize=False,
+                progressive=False
+            )
+        else:
+            image.save(img_byte_arr, format=image_format)
         return img_byte_arr.getvalue()
     
     @staticmethod
@@ -135,6 +287,9 @@ class DocumentProcessor:
         """
         Prepare images in format expected by Gemini API
         
+        Each image is encoded at most once; the result is cached on the image object,
+        so images must not be modified after they have been prepared.
+        
         Args:
             images: List of PIL Image objects
             
@@ -142,13 +297,19 @@ class DocumentProcessor:
             List of dictionaries with image data for Gemini
         """
         prepared_images = []
+        buffer = io.BytesIO()  # Shared scratch buffer for every encode below
         for img in images:
-            # Convert to bytes
-            img_bytes = DocumentProcessor.image_to_bytes(img)
-            prepared_images.append({
-                'mime_type': 'image/png',
-                'data': img_bytes
-            })
+            # Reuse the encoding from an earlier call on the same (unmodified) image
+            part = getattr(img, '_gemini_part', None)
+            if part is None:
+                # JPEG is much cheaper to encode and upload; keep PNG only where it preserves transparency
+                image_format = 'JPEG' if img.mode in DocumentProcessor.JPEG_MODES else 'PNG'
+                part = {
+                    'mime_type': f'image/{image_format.lower()}',
+                    'data': DocumentProcessor.image_to_bytes(img, image_format, buffer)
+                }
+                img._gemini_part = part
+            prepared_images.append(part)
         
         return prepared_images
 
@@ -4,22 +4,229 @@ Handles all interactions with Google's Gemini AI API for document analysis
 """
 
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+from typing import List, Dict, Any, Callable, Iterator, Optional
+import copy
+import datetime
+import hashlib
+import io
 import json
+import os
+import random
+import sqlite3
+import sys
+import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from document_processor import DocumentProcessor
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library json module
+    orjson = None
+
+
+def _strip_code_fence(text: str) -> str:
+    """Return the body of a markdown code fence around text, or text itself if unfenced"""
+    text = text.strip()
+    if not text.startswith("```"):
+        return text
+    
+    # Body starts after the opening fence line (which may carry a language tag) and
+    # ends at the last fence, so fences quoted inside the payload are kept intact
+    newline = text.find("\n")
+    if newline != -1:
+        start = newline + 1
+    else:
+        start = len("```json") if text.startswith("```json") else len("```")
+    end = text.rfind("```")
+    if end < start:
+        end = len(text)
+    return text[start:end].strip()
+
+
+def _intern_names(names: List[Any]) -> List[Any]:
+    """Intern string names so dict lookups keyed on them can match by identity"""
+    return [sys.intern(name) if isinstance(name, str) else name for name in names]
+
+
+def _parse_json(text: str) -> Any:
+    """
+    Parse a JSON response, ignoring a surrounding markdown code fence if present
+    
+    Requests use JSON mode, so fences only appear in responses cached before it.
+    """
+    text = _strip_code_fence(text)
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class RateLimiter:
+    """Thread-safe sliding-window limiter allowing at most `rpm` calls per minute"""
+    
+    def __init__(self, rpm: int = 60, period: float = 60.0):
+        """
+        Initialize the rate limiter
+        
+        Args:
+            rpm: Maximum number of calls allowed within any window of `period` seconds
+            period: Window length in seconds
+        """
+        self.rpm = rpm
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Block until a call is allowed, then record it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.rpm:
+                    self._calls.append(now)
+                    return
+                wait = self.period - (now - self._calls[0])
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    Persistent exact-match cache of Gemini response text, backed by SQLite
+    
+    Each insert prunes entries older than max_age seconds and all but the newest
+    max_rows entries, so the file stays bounded on a long-running deployment.
+    """
+    
+    MAX_ROWS = 20000  # Default cap on stored responses
+    MAX_AGE_SECONDS = 30 * 24 * 60 * 60  # Default age at which a response is dropped
+    
+    def __init__(self, path: str, max_rows: int = MAX_ROWS, max_age: float = MAX_AGE_SECONDS):
+        """
+        Open (or create) the cache
+        
+        Args:
+            path: Path of the SQLite database file
+            max_rows: Maximum number of responses kept
+            max_age: Seconds after which a stored response is dropped
+        """
+        self.path = path
+        self.max_rows = max_rows
+        self.max_age = max_age
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+            if "created" not in columns:
+                # Files from before pruning; their rows count as expired
+                conn.execute("ALTER TABLE responses ADD COLUMN created REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call keeps the cache safe to use from worker threads
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text for key, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set(self, key: str, text: str) -> None:
+        """Store the response text for key, pruning old and excess entries"""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, created) VALUES (?, ?, ?)",
+                (key, text, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,)
+            )
+
+
+class ContextCachedModel:
+    """
+    Stand-in for a GenerativeModel whose requests all share the same leading pages
+    
+    The pages are moved into a Gemini context cache on the first request that is
+    actually sent, so a run answered entirely from the response cache never creates
+    one. If the context cache can't be created, the pages are sent inline instead.
+    """
+    
+    def __init__(self, analyzer: "GeminiAnalyzer", context_parts: List[Any]):
+        """
+        Args:
+            analyzer: Analyzer whose model and generation settings to use
+            context_parts: Encoded parts shared by every request (see create_context_cache)
+        """
+        self.model_name = analyzer.model.model_name
+        self.context_parts = context_parts
+        self.context_cache: Optional[caching.CachedContent] = None  # Created on first request
+        self._analyzer = analyzer
+        self._model: Optional[genai.GenerativeModel] = None
+        self._lock = threading.Lock()
+    
+    def generate_content(self, contents: List[Any], **kwargs) -> Any:
+        """Send a request, creating the context cache first if this is the first one"""
+        with self._lock:
+            if self._model is None:
+                self.context_cache = self._analyzer.create_context_cache(self.context_parts)
+                if self.context_cache is not None:
+                    self._model = genai.GenerativeModel.from_cached_content(
+                        self.context_cache,
+                        generation_config=self._analyzer.generation_config
+                    )
+                else:
+                    self._model = self._analyzer.model
+        if self.context_cache is None:
+            contents = [*contents, *self.context_parts]
+        return self._model.generate_content(contents, **kwargs)
 
 
 class GeminiAnalyzer:
-    """Analyze student performance using Google Gemini AI"""
+    """
+    Analyze student performance using Google Gemini AI
+    
+    Wherever a method takes page images it also accepts pre-encoded parts from
+    DocumentProcessor.prepare_for_gemini, file handles from upload_images, or page
+    text. Images are encoded once and that encoding is reused by every later call.
+    """
     
-    def __init__(self, api_key: str, model_name: str = "gemini-2.5-pro"):
+    # Concurrent performance requests per analysis run, and the API quota shared by all runs
+    MAX_CONCURRENT_REQUESTS = 8
+    REQUESTS_PER_MINUTE = 60
+    MAX_RETRIES = 5  # Retries per request after a 429 or 503, with exponential backoff
+    # Concept-question pairs analyzed per performance request. The response carries one
+    # reasoning entry per pair, so this keeps it under max_output_tokens.
+    PERFORMANCE_BATCH_QUESTIONS = 24
+    CONTEXT_CACHE_TTL_SECONDS = 15 * 60
+    CONCEPT_ANALYSIS_CACHE_SIZE = 8  # Recent concept mappings kept in memory, per analyzer
+    CONFIDENCE_LEVELS = ("low", "medium", "high")
+    CONFIDENCE_RANKS = {level: rank for rank, level in enumerate(CONFIDENCE_LEVELS)}
+    
+    def __init__(self, api_key: str, model_name: str = "gemini-2.5-pro", cache_path: Optional[str] = None):
         """
         Initialize Gemini Analyzer
         
         Args:
             api_key: Google Gemini API key
             model_name: Name of the Gemini model to use
+            cache_path: Optional SQLite file for caching responses across runs
         """
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model_name)
@@ -28,9 +235,155 @@ class GeminiAnalyzer:
             "top_p": 0.8,
             "top_k": 40,
             "max_output_tokens": 8192,
+            # JSON mode: responses are always bare, valid JSON
+            "response_mime_type": "application/json",
         }
         self.last_question_reasoning: List[Dict[str, Any]] = []
         self.last_mapping_notes: List[str] = []
+        self._rate_limiter = RateLimiter(self.REQUESTS_PER_MINUTE)
+        self.response_cache = ResponseCache(cache_path) if cache_path else None
+        # LRU of concept mappings by request hash: every student answering the same
+        # paper shares one analysis sheet and question paper
+        self._concept_analyses: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._concept_analyses_lock = threading.Lock()
+    
+    def _generate_json(
+        self,
+        contents: List[Any],
+        model: Optional[genai.GenerativeModel] = None,
+        validate: Optional[Callable[[Any], None]] = None
+    ) -> Any:
+        """
+        Send a request to Gemini and parse its JSON response
+        
+        Responses are looked up in, and stored to, the persistent response cache
+        (if configured), so identical requests skip the API entirely. Only responses
+        that parse and pass validate are stored, and a cached response that fails
+        validate is requested again, so a malformed reply is never reused.
+        
+        Args:
+            contents: Prompt followed by images, inline parts, file handles or text
+            model: Optional model to use instead of the default
+            validate: Optional callable that checks (and may normalize in place) the
+                parsed response, raising an exception if its shape is wrong
+            
+        Returns:
+            Parsed JSON value
+        """
+        model = model or self.model
+        # Send every image as a downscaled, pre-encoded part rather than letting the
+        # SDK serialize it at full size on each call
+        contents = self._encode_images(contents)
+        
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self._response_cache_key(model, contents)
+            if cache_key is not None:
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    try:
+                        parsed = _parse_json(cached_text)
+                        if validate is not None:
+                            validate(parsed)
+                        return parsed
+                    except Exception:
+                        # Stored before it was validated; fetch a fresh reply to replace it
+                        pass
+        
+        response = self._call_with_retry(model, contents)
+        # A reply cut off at max_output_tokens is incomplete JSON at best
+        candidates = getattr(response, "candidates", None)
+        if candidates and getattr(candidates[0].finish_reason, "name", None) == "MAX_TOKENS":
+            raise ValueError("Response was cut off at max_output_tokens")
+        response_text = response.text
+        parsed = _parse_json(response_text)
+        if validate is not None:
+            validate(parsed)
+        
+        if cache_key is not None:
+            self.response_cache.set(cache_key, response_text)
+        return parsed
+    
+    def _call_with_retry(self, model: genai.GenerativeModel, contents: List[Any]) -> Any:
+        """
+        Call generate_content, backing off exponentially on quota and availability errors
+        
+        Other errors are raised immediately, as is the last error once MAX_RETRIES
+        retries have been used.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._rate_limiter.acquire()
+            try:
+                # Stream the reply so it is received while it is generated; resolve()
+                # drains the stream inside the try so mid-stream quota errors are retried
+                response = model.generate_content(
+                    contents,
+                    generation_config=self.generation_config,
+                    stream=True
+                )
+                response.resolve()
+                return response
+            except (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable):
+                if attempt == self.MAX_RETRIES:
+                    raise
+                time.sleep(min(60, 2 ** attempt + random.random()))
+    
+    def _response_cache_key(self, model: genai.GenerativeModel, contents: List[Any]) -> Optional[str]:
+        """
+        Hash a request's model, settings and contents, or None if a part can't be hashed
+        
+        For a ContextCachedModel the shared pages are hashed rather than the context
+        cache's name, which changes on every run.
+        """
+        digest = hashlib.blake2b(digest_size=32)
+        digest.update(str(model.model_name).encode())
+        context_parts = getattr(model, "context_parts", None)
+        if context_parts is None:
+            # Only the name is known of a context cache bound by the caller
+            digest.update(str(getattr(model, "cached_content", None)).encode())
+            context_parts = []
+        else:
+            digest.update(b"context")
+        digest.update(json.dumps(self.generation_config, default=str, sort_keys=True).encode())
+        for part in [*context_parts, *contents]:
+            if isinstance(part, str):
+                data = b"text:" + part.encode()
+            elif isinstance(part, dict) and 'data' in part:
+                data = bytes(part['data'])
+            elif getattr(part, "uri", None):
+                # Uploaded files are immutable, so their URI identifies the content
+                data = b"file:" + part.uri.encode()
+            else:
+                return None
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def upload_images(self, images: List[Image.Image]) -> List[Any]:
+        """
+        Upload images once through the Gemini Files API
+        
+        The returned handles can be passed to any analysis method in place of the
+        images, so repeated prompts reference the uploaded files instead of
+        re-sending the same image data on every call.
+        
+        Args:
+            images: List of PIL Images to upload; page text from text-based PDFs is
+                passed through as-is
+            
+        Returns:
+            List of uploaded file handles, in the same order as the images
+        """
+        uploaded_files = []
+        for image in images:
+            if isinstance(image, str):
+                uploaded_files.append(image)
+                continue
+            part = self._prepare_image(image)
+            uploaded_files.append(
+                genai.upload_file(io.BytesIO(part['data']), mime_type=part['mime_type'])
+            )
+        return uploaded_files
     
     def extract_concepts(self, analysis_sheet_images: List[Image.Image]) -> List[str]:
         """
@@ -53,21 +406,10 @@ class GeminiAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(
-                [prompt] + analysis_sheet_images,
-                generation_config=self.generation_config
+            concepts = self._generate_json(
+                [prompt, *analysis_sheet_images]
             )
-            
-            # Parse the JSON response
-            response_text = response.text.strip()
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif response_text.startswith("```"):
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            concepts = json.loads(response_text)
-            return concepts
+            return _intern_names(concepts) if isinstance(concepts, list) else concepts
         except Exception as e:
             raise ValueError(f"Error extracting concepts: {str(e)}")
     
@@ -141,48 +483,137 @@ class GeminiAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(
-                [prompt] + question_paper_images,
-                generation_config=self.generation_config
+            concept_analysis = self._generate_json(
+                [prompt, *question_paper_images],
+                validate=lambda response: self._normalize_concept_analysis(response, concepts)
             )
             
-            # Parse the JSON response
-            response_text = response.text.strip()
-            if response_text.startswith("```json"):
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif response_text.startswith("```"):
-                response_text = response_text.split("```")[1].split("```")[0].strip()
+            # Store latest reasoning metadata for optional external access
+            self.last_question_reasoning = concept_analysis["question_reasoning"]
+            self.last_mapping_notes = concept_analysis["evaluation_notes"]
+            
+            return concept_analysis
+        except Exception as e:
+            raise ValueError(f"Error analyzing question paper: {str(e)}")
+    
+    def extract_concepts_and_map(
+        self,
+        analysis_sheet_images: List[Image.Image],
+        question_paper_images: List[Image.Image]
+    ) -> Dict[str, Any]:
+        """
+        Extract concepts from the analysis sheet and map questions to them in one request
+        
+        Combines extract_concepts and analyze_question_paper, saving a full round-trip.
+        The last CONCEPT_ANALYSIS_CACHE_SIZE results are kept in memory, so repeating
+        the call for the same sheet and paper (e.g. for another student) is free.
+        
+        Args:
+            analysis_sheet_images: List of PIL Images of the analysis sheet
+            question_paper_images: List of PIL Images of the question paper (or upload handles)
             
-            concept_analysis = json.loads(response_text)
+        Returns:
+            Dictionary containing:
+                - "concepts": List of concept names, in sheet order
+                - "concept_map": Mapping of concept names to question numbers
+                - "question_reasoning": Step-by-step reasoning per question
+                - "evaluation_notes": Optional high-level reasoning notes
+        """
+        prompt = f"""
+        You are given an analysis sheet followed by a question paper.
+        The first {len(analysis_sheet_images)} image(s) are the analysis sheet; the remaining images are the question paper.
+        
+        Instructions:
+        1. From the analysis sheet, extract ALL concepts listed in the "Concept (With Explanation)" column, in order.
+           Extract every single concept from the sheet. Be thorough and precise.
+        2. For EACH concept, list ALL question numbers in the question paper that require or test that concept.
+        3. Every extracted concept must appear in the concept map, even if no questions map to it (use an empty list).
+        4. For EVERY question in the paper, provide a short structured explanation of how you evaluated the question, including:
+           - A one sentence summary of what the question is asking.
+           - The concepts that apply to that question with a short rationale and a confidence rating (low/medium/high).
+           - Optionally, any concepts you considered but rejected, with a short reason.
+        5. Provide optional high-level evaluation notes capturing your overall reasoning steps.
+        
+        Return ONLY a valid JSON object with the following shape:
+        {{
+            "concepts": ["Concept Name", ...],
+            "concept_map": {{
+                "Concept Name": [question_numbers...],
+                ...
+            }},
+            "question_reasoning": [
+                {{
+                    "question": <number>,
+                    "summary": "<short description of the question>",
+                    "concept_alignments": [
+                        {{
+                            "concept": "<concept name>",
+                            "rationale": "<why this concept applies>",
+                            "confidence": "low|medium|high"
+                        }}
+                    ],
+                    "considered_but_rejected": [
+                        {{
+                            "concept": "<concept name>",
+                            "reason": "<why it was rejected>"
+                        }}
+                    ]
+                }}
+            ],
+            "evaluation_notes": [
+                "<high-level note about your reasoning process>",
+                ...
+            ]
+        }}
+        
+        Always return valid JSON only. Do not wrap the response in markdown code fences.
+        """
+        
+        def validate(response: Dict[str, Any]) -> None:
+            if not isinstance(response.get("concepts"), list):
+                raise ValueError("Response missing 'concepts' list")
             
-            # Ensure required keys exist
-            if "concept_map" not in concept_analysis:
-                raise ValueError("Response missing 'concept_map'")
-            if not isinstance(concept_analysis["concept_map"], dict):
-                raise ValueError("'concept_map' must be an object/dictionary")
-            if "question_reasoning" not in concept_analysis:
-                concept_analysis["question_reasoning"] = []
-            if "evaluation_notes" not in concept_analysis:
-                concept_analysis["evaluation_notes"] = []
+            # Concept names are used as lookup keys for every concept from here on
+            response["concepts"] = _intern_names(response["concepts"])
+            self._normalize_concept_analysis(response, response["concepts"])
+        
+        try:
+            contents = self._encode_images([prompt, *analysis_sheet_images, *question_paper_images])
+            memo_key = self._response_cache_key(self.model, contents)
+            if memo_key is not None:
+                with self._concept_analyses_lock:
+                    cached = self._concept_analyses.get(memo_key)
+                    if cached is not None:
+                        self._concept_analyses.move_to_end(memo_key)
+                if cached is not None:
+                    concept_analysis = copy.deepcopy(cached)
+                    self.last_question_reasoning = concept_analysis["question_reasoning"]
+                    self.last_mapping_notes = concept_analysis["evaluation_notes"]
+                    return concept_analysis
             
-            # Guarantee all concepts are present in the concept_map
-            for concept in concepts:
-                concept_analysis["concept_map"].setdefault(concept, [])
+            concept_analysis = self._generate_json(contents, validate=validate)
             
             # Store latest reasoning metadata for optional external access
             self.last_question_reasoning = concept_analysis["question_reasoning"]
             self.last_mapping_notes = concept_analysis["evaluation_notes"]
             
+            if memo_key is not None:
+                with self._concept_analyses_lock:
+                    self._concept_analyses[memo_key] = copy.deepcopy(concept_analysis)
+                    while len(self._concept_analyses) > self.CONCEPT_ANALYSIS_CACHE_SIZE:
+                        self._concept_analyses.popitem(last=False)
+            
             return concept_analysis
         except Exception as e:
-            raise ValueError(f"Error analyzing question paper: {str(e)}")
+            raise ValueError(f"Error extracting and mapping concepts: {str(e)}")
     
     def analyze_student_performance(
         self,
         question_paper_images: List[Image.Image],
         answer_sheet_images: List[Image.Image],
         concept: str,
-        question_numbers: List[int]
+        question_numbers: List[int],
+        model: Optional[genai.GenerativeModel] = None
     ) -> Dict[str, Any]:
         """
         Analyze student's performance for a specific concept
@@ -192,6 +623,8 @@ class GeminiAnalyzer:
             answer_sheet_images: List of PIL Images of the answer sheet
             concept: Name of the concept to analyze
             question_numbers: List of question numbers that test this concept
+            model: Optional model to use instead of the default, e.g. one bound to a
+                context cache that already holds the images (pass empty image lists then)
             
         Returns:
             Dictionary containing:
@@ -244,52 +677,164 @@ class GeminiAnalyzer:
         """
         
         try:
-            # Combine all images for context
-            all_images = question_paper_images + answer_sheet_images
-            
-            response = self.model.generate_content(
-                [prompt] + all_images,
-                generation_config=self.generation_config
+            # Question paper and answer sheet both provide context
+            performance = self._generate_json(
+                [prompt, *question_paper_images, *answer_sheet_images],
+                model=model,
+                validate=self._check_performance
             )
             
-            # Parse the JSON response
-            response_text = response.text.strip()
-            if response_text.startswith("```json"):
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif response_text.startswith("```"):
-                response_text = response_text.split("```")[1].split("```")[0].strip()
+            return self._with_performance_defaults(performance)
+        except Exception as e:
+            raise ValueError(f"Error analyzing student performance for {concept}: {str(e)}")
+    
+    def analyze_all_performance(
+        self,
+        question_paper_images: List[Image.Image],
+        answer_sheet_images: List[Image.Image],
+        concept_questions: Dict[str, List[int]],
+        model: Optional[genai.GenerativeModel] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Analyze student's performance for several concepts in a single request
+        
+        Args:
+            question_paper_images: List of PIL Images of the question paper
+            answer_sheet_images: List of PIL Images of the answer sheet
+            concept_questions: Mapping of concept names to the question numbers that test them
+            model: Optional model to use instead of the default (see analyze_student_performance)
             
-            performance = json.loads(response_text)
+        Returns:
+            Mapping of concept name to the same dictionary analyze_student_performance
+            returns. Concepts missing from the model's response are left out.
+        """
+        concepts_str = "\n".join([
+            f'{i+1}. "{concept}" - questions {", ".join(map(str, question_numbers))}'
+            for i, (concept, question_numbers) in enumerate(concept_questions.items())
+        ])
+        
+        prompt = f"""
+        Analyze the student's performance for ALL of the following concepts.
+        Each concept is listed with the questions that test it:
+        {concepts_str}
+        
+        For each concept, compare the student's answers (in the answer sheet) with the correct approach for each of its questions.
+        Focus specifically on how the student applied (or failed to apply) that concept.
+        
+        For each question, determine whether a mistake related to the concept occurred and describe the reasoning process.
+        
+        Return ONLY a valid JSON object with the following structure, with one entry per concept using the exact concept names above:
+        {{
+            "concept_results": {{
+                "<concept name>": {{
+                    "mistakes": [<question numbers where the student made a concept-related mistake>],
+                    "details": {{
+                        "<question number>": "<concise description of the mistake and what should have been done>"
+                    }},
+                    "reasoning": [
+                        {{
+                            "question": <number>,
+                            "observation": "<what you saw in the student's answer>",
+                            "concept_evaluation": "<how the concept was (or should have been) applied>",
+                            "conclusion": "<did they use the concept correctly or make a mistake?>",
+                            "confidence": "low|medium|high"
+                        }}
+                    ],
+                    "evaluation_notes": [
+                        "<optional high-level note about the concept performance>"
+                    ]
+                }}
+            }}
+        }}
+        
+        Use empty lists/objects where appropriate. Do not include markdown fences or explanatory text outside the JSON.
+        """
+        
+        try:
+            # Question paper and answer sheet both provide context
+            concept_results = self._generate_json(
+                [prompt, *question_paper_images, *answer_sheet_images],
+                model=model,
+                validate=self._check_concept_results
+            )
             
-            if not isinstance(performance, dict):
-                raise ValueError("Performance response must be a JSON object")
-            performance.setdefault("mistakes", [])
-            performance.setdefault("details", {})
-            performance.setdefault("reasoning", [])
-            performance.setdefault("evaluation_notes", [])
+            performances = {}
+            for concept in concept_questions:
+                performance = concept_results["concept_results"].get(concept)
+                if not isinstance(performance, dict):
+                    continue
+                performances[concept] = self._with_performance_defaults(performance)
             
-            return performance
+            return performances
         except Exception as e:
-            raise ValueError(f"Error analyzing student performance for {concept}: {str(e)}")
+            raise ValueError(f"Error analyzing student performance: {str(e)}")
     
     def analyze_all_concepts(
         self,
         analysis_sheet_images: List[Image.Image],
         question_paper_images: List[Image.Image],
         answer_sheet_images: List[Image.Image],
-        progress_callback=None
+        progress_callback=None,
+        use_context_cache: bool = False,
+        concepts: Optional[List[str]] = None,
+        concept_analysis: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """
         Perform complete analysis for all concepts
         
         Args:
             analysis_sheet_images: Images of the analysis sheet
-            question_paper_images: Images of the question paper
-            answer_sheet_images: Images of the answer sheet
+            question_paper_images: Images of the question paper (or handles from upload_images)
+            answer_sheet_images: Images of the answer sheet (or handles from upload_images)
             progress_callback: Optional callback function for progress updates
+            use_context_cache: Hold the question paper and answer sheet in a Gemini
+                context cache for the per-concept calls (see create_context_cache)
+            concepts: Optional concept list already extracted from the analysis sheet;
+                only the question paper is then mapped (see analyze_question_paper)
+            concept_analysis: Optional result of an earlier extract_concepts_and_map
+                call for the same sheet and paper; skips both steps entirely
             
         Returns:
-            List of dictionaries with concept analysis results. Each dictionary includes:
+            List of per-concept result dictionaries, as yielded by iter_analyze_concepts
+        """
+        return list(self.iter_analyze_concepts(
+            analysis_sheet_images,
+            question_paper_images,
+            answer_sheet_images,
+            progress_callback=progress_callback,
+            use_context_cache=use_context_cache,
+            concepts=concepts,
+            concept_analysis=concept_analysis
+        ))
+    
+    def iter_analyze_concepts(
+        self,
+        analysis_sheet_images: List[Image.Image],
+        question_paper_images: List[Image.Image],
+        answer_sheet_images: List[Image.Image],
+        progress_callback=None,
+        use_context_cache: bool = False,
+        concepts: Optional[List[str]] = None,
+        concept_analysis: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Perform complete analysis for all concepts, yielding each concept's result
+        as soon as it is ready so callers can display partial results
+        
+        Args:
+            analysis_sheet_images: Images of the analysis sheet
+            question_paper_images: Images of the question paper (or handles from upload_images)
+            answer_sheet_images: Images of the answer sheet (or handles from upload_images)
+            progress_callback: Optional callback function for progress updates
+            use_context_cache: Hold the question paper and answer sheet in a Gemini
+                context cache for the per-concept calls (see create_context_cache)
+            concepts: Optional concept list already extracted from the analysis sheet;
+                only the question paper is then mapped (see analyze_question_paper)
+            concept_analysis: Optional result of an earlier extract_concepts_and_map
+                call for the same sheet and paper; skips both steps entirely
+            
+        Yields:
+            One dictionary per concept, in concept order. Each dictionary includes:
                 - concept: Concept name
                 - tested_count: Number of questions mapped to the concept
                 - mistakes_count: Number of mistakes detected for the concept
@@ -299,70 +844,111 @@ class GeminiAnalyzer:
                 - performance_reasoning: Reasoning about the student's performance per question
                 - performance_notes: Optional high-level notes about the student's performance
         """
-        results = []
+        # Encode any in-memory pages once up front, in a single parallel pass; every
+        # concept re-sends the same question paper and answer sheet
+        encoded = self._encode_images([*analysis_sheet_images, *question_paper_images, *answer_sheet_images])
+        analysis_end = len(analysis_sheet_images)
+        question_end = analysis_end + len(question_paper_images)
+        analysis_sheet_images = encoded[:analysis_end]
+        question_paper_images = encoded[analysis_end:question_end]
+        answer_sheet_images = encoded[question_end:]
+        # Question paper followed by answer sheet, the shared context of every performance request
+        context_images = encoded[analysis_end:]
         
-        # Step 1: Extract concepts
-        if progress_callback:
-            progress_callback("Extracting concepts from analysis sheet...")
-        concepts = self.extract_concepts(analysis_sheet_images)
-        
-        # Step 2: Analyze question paper
-        if progress_callback:
-            progress_callback(f"Analyzing question paper for {len(concepts)} concepts...")
-        concept_analysis = self.analyze_question_paper(question_paper_images, concepts)
+        # Steps 1-2: Extract concepts and map questions to them in a single request,
+        # skipping whatever the caller already has
+        if concept_analysis is not None:
+            concept_analysis = dict(concept_analysis)
+            concepts = _intern_names(concept_analysis.get("concepts") or concepts or [])
+            self._normalize_concept_analysis(concept_analysis, concepts)
+        elif concepts is not None:
+            if progress_callback:
+                progress_callback("Analyzing question paper...")
+            concepts = _intern_names(concepts)
+            concept_analysis = self.analyze_question_paper(question_paper_images, concepts)
+        else:
+            if progress_callback:
+                progress_callback("Extracting concepts and analyzing question paper...")
+            concept_analysis = self.extract_concepts_and_map(analysis_sheet_images, question_paper_images)
+            concepts = concept_analysis["concepts"]
         concept_questions = concept_analysis.get("concept_map", {})
-        question_reasoning = concept_analysis.get("question_reasoning", [])
+        concept_reasoning_index = self._build_concept_reasoning_index(
+            concept_analysis.get("question_reasoning", [])
+        )
         
-        # Step 3: Analyze student performance for each concept
+        # Step 3: Analyze student performance for each concept. Tested concepts are
+        # analyzed several per request; the batches run concurrently and results
+        # are yielded in concept order.
         total_concepts = len(concepts)
-        for idx, concept in enumerate(concepts):
-            if progress_callback:
-                progress_callback(f"Analyzing concept {idx+1}/{total_concepts}: {concept}")
-            
-            question_numbers_raw = concept_questions.get(concept, [])
-            question_numbers: List[int] = []
-            for number in question_numbers_raw:
-                if isinstance(number, int):
-                    question_numbers.append(number)
-                elif isinstance(number, str) and number.strip().isdigit():
-                    question_numbers.append(int(number.strip()))
-                else:
-                    question_numbers.append(number)
-            
-            concept_reasoning = self._extract_concept_reasoning(question_reasoning, concept)
-            
-            if not question_numbers:
-                # Concept not tested
-                results.append({
-                    "concept": concept,
-                    "tested_count": 0,
-                    "mistakes_count": 0,
-                    "mistake_questions": [],
-                    "details": {},
-                    "concept_reasoning": concept_reasoning,
-                    "performance_reasoning": [],
-                    "performance_notes": []
-                })
-            else:
-                # Analyze performance
-                performance = self.analyze_student_performance(
-                    question_paper_images,
-                    answer_sheet_images,
-                    concept,
-                    question_numbers
+        concept_question_numbers: List[List[int]] = [
+            self._coerce_int_list(concept_questions.get(concept, []))
+            for concept in concepts
+        ]
+        
+        # With a context cache the pages are already on the server, so each
+        # performance request carries only its prompt. The cache is created on the
+        # first request that misses the response cache.
+        if use_context_cache and any(concept_question_numbers):
+            performance_model = ContextCachedModel(self, context_images)
+            performance_images = ([], [])
+        else:
+            performance_model = None
+            performance_images = (question_paper_images, answer_sheet_images)
+        
+        tested_concepts = [
+            (concept, question_numbers)
+            for concept, question_numbers in zip(concepts, concept_question_numbers)
+            if question_numbers
+        ]
+        batches = self._batch_concepts(tested_concepts, self.PERFORMANCE_BATCH_QUESTIONS)
+        
+        # A pool per run, sized to its batches: the app shares one analyzer across
+        # browser sessions, so a shared pool would queue every user behind the
+        # largest run. The genai client's gRPC channel is created once per process,
+        # so connections are still reused across runs.
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(self.MAX_CONCURRENT_REQUESTS, len(batches))),
+            thread_name_prefix="gemini"
+        )
+        futures: List[Any] = []
+        try:
+            concept_futures: Dict[str, Any] = {}
+            for batch in batches:
+                future = executor.submit(
+                    self._analyze_performance_batch,
+                    *performance_images,
+                    batch,
+                    model=performance_model
                 )
+                futures.append(future)
+                for concept in batch:
+                    concept_futures[concept] = future
+            
+            for idx, (concept, question_numbers) in enumerate(zip(concepts, concept_question_numbers)):
+                if progress_callback:
+                    progress_callback(f"Analyzing concept {idx+1}/{total_concepts}: {concept}")
+                
+                concept_reasoning = concept_reasoning_index.get(concept, [])
+                
+                if not question_numbers:
+                    # Concept not tested
+                    yield {
+                        "concept": concept,
+                        "tested_count": 0,
+                        "mistakes_count": 0,
+                        "mistake_questions": [],
+                        "details": {},
+                        "concept_reasoning": concept_reasoning,
+                        "performance_reasoning": [],
+                        "performance_notes": []
+                    }
+                    continue
                 
-                mistakes_raw = performance.get("mistakes", [])
-                mistake_questions: List[int] = []
-                for number in mistakes_raw:
-                    if isinstance(number, int):
-                        mistake_questions.append(number)
-                    elif isinstance(number, str) and number.strip().isdigit():
-                        mistake_questions.append(int(number.strip()))
-                    else:
-                        mistake_questions.append(number)
+                performance = concept_futures[concept].result()[concept]
                 
-                results.append({
+                mistake_questions = self._coerce_int_list(performance.get("mistakes", []))
+                
+                yield {
                     "concept": concept,
                     "tested_count": len(question_numbers),
                     "mistakes_count": len(mistake_questions),
@@ -371,15 +957,218 @@ class GeminiAnalyzer:
                     "concept_reasoning": concept_reasoning,
                     "performance_reasoning": performance.get("reasoning", []),
                     "performance_notes": performance.get("evaluation_notes", [])
-                })
-            
-            # Small delay to avoid rate limiting
-            time.sleep(0.5)
+                }
+        finally:
+            # Don't keep spending API calls if the caller stops early or a call failed
+            executor.shutdown(wait=False, cancel_futures=True)
+            if performance_model is not None:
+                self._delete_context_cache(performance_model, wait_for=futures)
         
         if progress_callback:
             progress_callback("Analysis complete!")
+    
+    def create_context_cache(self, images: List[Any]) -> Optional[caching.CachedContent]:
+        """
+        Store images in a short-lived Gemini context cache
         
-        return results
+        Requests made through a model bound to the cache reuse the cached tokens
+        instead of resending (and being billed in full for) the images each time.
+        
+        Args:
+            images: PIL Images, inline parts or file handles from upload_images
+            
+        Returns:
+            The cached content, or None if caching isn't available (unsupported model,
+            or too few tokens to meet the API minimum); callers then send images inline
+        """
+        try:
+            return caching.CachedContent.create(
+                model=self.model.model_name,
+                contents=[{"role": "user", "parts": list(images)}],
+                ttl=datetime.timedelta(seconds=self.CONTEXT_CACHE_TTL_SECONDS)
+            )
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _delete_context_cache(model: ContextCachedModel, wait_for: List[Any]) -> None:
+        """Delete a model's context cache, if any, once no in-flight request still needs it"""
+        for future in wait_for:
+            if future is not None and not future.cancelled():
+                try:
+                    future.exception()
+                except Exception:
+                    pass
+        if model.context_cache is None:
+            return
+        try:
+            model.context_cache.delete()
+        except Exception:
+            # It expires on its own after CONTEXT_CACHE_TTL_SECONDS
+            pass
+    
+    @staticmethod
+    def _normalize_concept_analysis(concept_analysis: Dict[str, Any], concepts: List[str]) -> None:
+        """
+        Validate a concept mapping response in place and fill in its defaults
+        
+        The concept_map is rebuilt in a single pass with exactly one entry per concept,
+        in concept order; questions mapped to concepts outside the list are dropped.
+        """
+        if "concept_map" not in concept_analysis:
+            raise ValueError("Response missing 'concept_map'")
+        concept_map = concept_analysis["concept_map"]
+        if not isinstance(concept_map, dict):
+            raise ValueError("'concept_map' must be an object/dictionary")
+        concept_analysis["concept_map"] = {concept: concept_map.get(concept, []) for concept in concepts}
+        concept_analysis.setdefault("question_reasoning", [])
+        concept_analysis.setdefault("evaluation_notes", [])
+    
+    @staticmethod
+    def _check_performance(performance: Any) -> None:
+        """Validate a single-concept performance response"""
+        if not isinstance(performance, dict):
+            raise ValueError("Performance response must be a JSON object")
+    
+    @staticmethod
+    def _check_concept_results(concept_results: Any) -> None:
+        """Validate a batched performance response"""
+        if not isinstance(concept_results, dict) or \
+           not isinstance(concept_results.get("concept_results"), dict):
+            raise ValueError("Response missing 'concept_results' object")
+    
+    @staticmethod
+    def _coerce_int_list(values: List[Any]) -> List[Any]:
+        """Convert numeric strings (e.g. "4") to ints, leaving other values unchanged"""
+        return [
+            int(value) if isinstance(value, str) and value.strip().isdigit() else value
+            for value in values
+        ]
+    
+    @staticmethod
+    def _batch_concepts(
+        tested_concepts: List[Any],
+        max_questions: int
+    ) -> List[Dict[str, List[int]]]:
+        """
+        Group (concept, question_numbers) pairs into as few requests as possible
+        
+        Concepts are packed in order until a batch would exceed max_questions mapped
+        questions; a single concept larger than that still gets a batch of its own.
+        """
+        batches: List[Dict[str, List[int]]] = []
+        batch: Dict[str, List[int]] = {}
+        batch_questions = 0
+        for concept, question_numbers in tested_concepts:
+            if batch and batch_questions + len(question_numbers) > max_questions:
+                batches.append(batch)
+                batch = {}
+                batch_questions = 0
+            batch[concept] = question_numbers
+            batch_questions += len(question_numbers)
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    @staticmethod
+    def _with_performance_defaults(performance: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in the optional fields of a performance object in one dict merge"""
+        return {
+            "mistakes": [],
+            "details": {},
+            "reasoning": [],
+            "evaluation_notes": [],
+            **performance
+        }
+    
+    @staticmethod
+    def _prepare_image(image: Image.Image) -> Dict[str, Any]:
+        """
+        Encode an image as an inline part, downscaling it first if it is oversized
+        
+        Pages from DocumentProcessor are already within MAX_IMAGE_SIZE; images passed
+        in directly are resized on a copy, so the caller's image is left untouched.
+        The part is cached on the image, so later calls reuse it.
+        """
+        part = getattr(image, '_gemini_part', None)
+        if part is None:
+            prepared = image
+            if image.width > DocumentProcessor.MAX_IMAGE_SIZE[0] or \
+               image.height > DocumentProcessor.MAX_IMAGE_SIZE[1]:
+                prepared = DocumentProcessor.optimize_image(image.copy())
+            part = DocumentProcessor.prepare_for_gemini([prepared])[0]
+            image._gemini_part = part
+        return part
+    
+    @staticmethod
+    def _encode_images(images: List[Any]) -> List[Any]:
+        """
+        Replace PIL Images with pre-encoded inline parts, passing other parts through
+        
+        Args:
+            images: PIL Images, file handles from upload_images, text or prepared parts
+            
+        Returns:
+            List of content parts that can be sent repeatedly without re-encoding
+        """
+        pending = [img for img in images if isinstance(img, Image.Image) and not hasattr(img, '_gemini_part')]
+        if len(pending) > 1:
+            # Resizing and encoding run in Pillow's C code with the GIL released
+            with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+                list(executor.map(GeminiAnalyzer._prepare_image, pending))
+        
+        return [
+            GeminiAnalyzer._prepare_image(img) if isinstance(img, Image.Image) else img
+            for img in images
+        ]
+    
+    def _analyze_performance_batch(
+        self,
+        question_paper_images: List[Any],
+        answer_sheet_images: List[Any],
+        concept_questions: Dict[str, List[int]],
+        model: Optional[genai.GenerativeModel] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        analyze_all_performance, retrying on its own any concept the batched
+        response leaves out so every requested concept has a result
+        
+        A batch whose response is unusable (typically cut off at max_output_tokens,
+        which thinking tokens share) is split in half and each half retried, down to
+        single-concept requests. API errors are raised as-is, since smaller requests
+        won't fix them.
+        """
+        try:
+            performances = self.analyze_all_performance(
+                question_paper_images,
+                answer_sheet_images,
+                concept_questions,
+                model=model
+            )
+        except ValueError as e:
+            if isinstance(e.__context__, google_exceptions.GoogleAPICallError):
+                raise
+            performances = {}
+            if len(concept_questions) > 1:
+                batch = list(concept_questions.items())
+                middle = len(batch) // 2
+                for half in (batch[:middle], batch[middle:]):
+                    performances.update(self._analyze_performance_batch(
+                        question_paper_images,
+                        answer_sheet_images,
+                        dict(half),
+                        model=model
+                    ))
+        for concept, question_numbers in concept_questions.items():
+            if concept not in performances:
+                performances[concept] = self.analyze_student_performance(
+                    question_paper_images,
+                    answer_sheet_images,
+                    concept,
+                    question_numbers,
+                    model=model
+                )
+        return performances
     
     @staticmethod
     def _extract_concept_reasoning(
@@ -389,6 +1178,9 @@ class GeminiAnalyzer:
         """
         Filter question-level reasoning down to the steps relevant to a specific concept.
         
+        To filter for many concepts, build the index once with
+        _build_concept_reasoning_index instead.
+        
         Args:
             question_reasoning: List of reasoning objects from analyze_question_paper
             concept: Concept name to filter for
@@ -396,41 +1188,42 @@ class GeminiAnalyzer:
         Returns:
             Filtered list of reasoning entries specific to the concept
         """
-        filtered_reasoning: List[Dict[str, Any]] = []
+        return GeminiAnalyzer._build_concept_reasoning_index(question_reasoning).get(concept, [])
+    
+    @staticmethod
+    def _build_concept_reasoning_index(
+        question_reasoning: List[Dict[str, Any]]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Group question-level reasoning by concept in a single pass.
+        
+        Args:
+            question_reasoning: List of reasoning objects from analyze_question_paper
+        
+        Returns:
+            Mapping of concept name to its filtered reasoning entries, in question order
+        """
+        index: Dict[str, List[Dict[str, Any]]] = {}
         
         for entry in question_reasoning or []:
             concept_alignments = entry.get("concept_alignments", [])
             if not isinstance(concept_alignments, list):
                 continue
             
-            matching_alignments = [
-                alignment for alignment in concept_alignments
-                if isinstance(alignment, dict) and alignment.get("concept") == concept
-            ]
+            # Alignments for each concept this question touches, in response order
+            alignments_by_concept: Dict[str, List[Dict[str, Any]]] = {}
+            for alignment in concept_alignments:
+                if isinstance(alignment, dict) and isinstance(alignment.get("concept"), str):
+                    alignments_by_concept.setdefault(alignment["concept"], []).append(alignment)
             
-            if not matching_alignments:
+            if not alignments_by_concept:
                 continue
             
             question_number = entry.get("question")
             if isinstance(question_number, str) and question_number.strip().isdigit():
                 question_number = int(question_number.strip())
             
-            # Determine overall confidence for this question-concept pair
-            confidence_levels = [a.get("confidence", "medium") for a in matching_alignments]
-            if "high" in confidence_levels:
-                overall_confidence = "high"
-            elif "medium" in confidence_levels:
-                overall_confidence = "medium"
-            else:
-                overall_confidence = "low"
-            
-            filtered_entry = {
-                "question": question_number,
-                "summary": entry.get("summary", ""),
-                "concept_alignments": matching_alignments,
-                "confidence": overall_confidence
-            }
-            
+            rejected_names = None
             if "considered_but_rejected" in entry:
                 rejected = entry.get("considered_but_rejected", [])
                 # Extract just the concept names for display
@@ -439,11 +1232,30 @@ class GeminiAnalyzer:
                         r.get("concept", "") if isinstance(r, dict) else str(r)
                         for r in rejected
                     ]
-                    filtered_entry["considered_but_rejected"] = [r for r in rejected_names if r]
+                    rejected_names = [r for r in rejected_names if r]
             
-            filtered_reasoning.append(filtered_entry)
+            for concept, matching_alignments in alignments_by_concept.items():
+                # Overall confidence for this question-concept pair is the highest given;
+                # unrecognised values count as low, a missing one as medium
+                rank = 0
+                for alignment in matching_alignments:
+                    confidence = alignment.get("confidence", "medium")
+                    if isinstance(confidence, str):
+                        rank = max(rank, GeminiAnalyzer.CONFIDENCE_RANKS.get(confidence, 0))
+                overall_confidence = GeminiAnalyzer.CONFIDENCE_LEVELS[rank]
+                
+                filtered_entry = {
+                    "question": question_number,
+                    "summary": entry.get("summary", ""),
+                    "concept_alignments": matching_alignments,
+                    "confidence": overall_confidence
+                }
+                if rejected_names is not None:
+                    filtered_entry["considered_but_rejected"] = list(rejected_names)
+                
+                index.setdefault(concept, []).append(filtered_entry)
         
-        return filtered_reasoning
+        return index
     
     @staticmethod
     def format_response_1(result: Dict[str, Any]) -> str:
@@ -482,10 +1294,9 @@ class GeminiAnalyzer:
         if not result["details"]:
             return "No detailed analysis needed (no mistakes)"
         
-        details_list = []
-        for q_num in sorted(result["mistake_questions"]):
-            detail = result["details"].get(str(q_num), "Error not specified")
-            details_list.append(f"Q{q_num}: {detail}")
-        
-        return "\n".join(details_list)
+        details = result["details"]
+        return "\n".join([
+            f"Q{q_num}: {details.get(str(q_num), 'Error not specified')}"
+            for q_num in sorted(result["mistake_questions"])
+        ])
 
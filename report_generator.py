@@ -3,194 +3,314 @@ Report Generation Module
 Generates Excel and PDF reports from analysis results
 """
 
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
-from fpdf import FPDF
+import functools
 import io
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from datetime import datetime
 import unicodedata
-import re
+
+try:
+    import xlsxwriter
+except ImportError:  # Optional: fall back to openpyxl for the Excel report
+    xlsxwriter = None
+
+if TYPE_CHECKING:
+    from fpdf import FPDF
 
 
 class ReportGenerator:
     """Generate formatted reports in Excel and PDF formats"""
     
+    # Common mathematical symbol replacements for the ASCII-only standard PDF fonts,
+    # as a str.translate table so sanitizing is a single pass over the text
+    PDF_SYMBOL_TABLE = str.maketrans({
+        '∫': 'integral',
+        '∑': 'sum',
+        '∏': 'product',
+        '√': 'sqrt',
+        '∞': 'infinity',
+        '≈': '~',
+        '≠': '!=',
+        '≤': '<=',
+        '≥': '>=',
+        '°': ' degrees',
+        'π': 'pi',
+        'θ': 'theta',
+        'α': 'alpha',
+        'β': 'beta',
+        'γ': 'gamma',
+        'δ': 'delta',
+        'λ': 'lambda',
+        'μ': 'mu',
+        'σ': 'sigma',
+        'φ': 'phi',
+        'ψ': 'psi',
+        'ω': 'omega',
+        '²': '^2',
+        '³': '^3',
+        '¹': '^1',
+        '⁴': '^4',
+        '⁵': '^5',
+        '⁶': '^6',
+        '⁷': '^7',
+        '⁸': '^8',
+        '⁹': '^9',
+        '⁰': '^0',
+        '×': 'x',
+        '÷': '/',
+        '±': '+/-',
+        '→': '->',
+        '←': '<-',
+        '↔': '<->',
+        '•': '*',
+        '·': '.',
+    })
+    
+    # Excel report columns as (header, width)
+    EXCEL_COLUMNS = (
+        ("Concept No.", 10),
+        ("Concept (With Explanation)", 40),
+        ("Example", 30),
+        ("Status", 60),
+        ("AI Evaluation Process", 70),
+    )
+    HEADER_COLOR = "366092"  # Excel header fill (RGB hex)
+    EXCEL_ENGINES = ("xlsxwriter", "openpyxl")  # Writers generate_excel can use
+    SANITIZE_CACHE_MAX_LENGTH = 256  # Longer texts (per-student paragraphs) rarely repeat
+    
     @staticmethod
     def sanitize_for_pdf(text: str) -> str:
         """
         Sanitize text for PDF output by replacing/removing Unicode characters
         that aren't supported by standard PDF fonts
         
+        Results for short texts are memoized: reports repeat the same concept names
+        and phrases for many concepts and students.
+        
         Args:
             text: Input text that may contain Unicode characters
             
         Returns:
             Sanitized text safe for PDF rendering
         """
-        # Common mathematical symbol replacements
-        replacements = {
-            '∫': 'integral',
-            '∑': 'sum',
-            '∏': 'product',
-            '√': 'sqrt',
-            '∞': 'infinity',
-            '≈': '~',
-            '≠': '!=',
-            '≤': '<=',
-            '≥': '>=',
-            '°': ' degrees',
-            'π': 'pi',
-            'θ': 'theta',
-            'α': 'alpha',
-            'β': 'beta',
-            'γ': 'gamma',
-            'δ': 'delta',
-            'λ': 'lambda',
-            'μ': 'mu',
-            'σ': 'sigma',
-            'φ': 'phi',
-            'ψ': 'psi',
-            'ω': 'omega',
-            '²': '^2',
-            '³': '^3',
-            '¹': '^1',
-            '⁴': '^4',
-            '⁵': '^5',
-            '⁶': '^6',
-            '⁷': '^7',
-            '⁸': '^8',
-            '⁹': '^9',
-            '⁰': '^0',
-            '×': 'x',
-            '÷': '/',
-            '±': '+/-',
-            '→': '->',
-            '←': '<-',
-            '↔': '<->',
-            '•': '*',
-            '·': '.',
-        }
-        
-        # Apply replacements
-        for unicode_char, ascii_equiv in replacements.items():
-            text = text.replace(unicode_char, ascii_equiv)
-        
-        # Try to convert remaining Unicode to ASCII
-        try:
-            # Normalize to decomposed form and remove combining characters
-            text = unicodedata.normalize('NFKD', text)
-            text = text.encode('ascii', 'ignore').decode('ascii')
-        except:
-            # If all else fails, remove non-ASCII characters
-            text = re.sub(r'[^\x00-\x7F]+', '', text)
-        
-        return text
+        # Already safe, which most text is; isascii() is a flag check on the str
+        if text.isascii():
+            return text
+        if len(text) < ReportGenerator.SANITIZE_CACHE_MAX_LENGTH:
+            return ReportGenerator._sanitize_short(text)
+        return ReportGenerator._sanitize_unicode(text)
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _sanitize_short(text: str) -> str:
+        """Memoized _sanitize_unicode, for texts under SANITIZE_CACHE_MAX_LENGTH"""
+        return ReportGenerator._sanitize_unicode(text)
+    
+    @staticmethod
+    def _sanitize_unicode(text: str) -> str:
+        """Map symbols to ASCII spellings and drop whatever else isn't ASCII"""
+        text = text.translate(ReportGenerator.PDF_SYMBOL_TABLE)
+        
+        # Convert remaining Unicode to ASCII. NFKD splits accented letters into base
+        # letter + combining mark, so dropping non-ASCII keeps the base letter ("é" -> "e")
+        return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
     
     @staticmethod
-    def generate_excel(results: List[Dict[str, Any]]) -> bytes:
+    def generate_excel(
+        results: List[Dict[str, Any]],
+        formatted: Optional[List[tuple]] = None,
+        engine: Optional[str] = None
+    ) -> bytes:
         """
         Generate Excel report with formatted concept analysis
         
+        Written with XlsxWriter when it is installed, otherwise with openpyxl;
+        both produce the same sheet.
+        
         Args:
             results: List of analysis results for each concept
+            formatted: Optional output of format_results(results), to reuse
+            engine: Optional writer to use instead of the default, "xlsxwriter"
+                or "openpyxl"
             
         Returns:
             Excel file as bytes
         """
-        # Create workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Performance Analysis"
-        
-        # Define styles
-        header_font = Font(bold=True, size=12, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        
-        cell_alignment = Alignment(vertical="top", wrap_text=True)
-        border = Border(
+        if engine is None:
+            engine = "openpyxl" if xlsxwriter is None else "xlsxwriter"
+        if engine not in ReportGenerator.EXCEL_ENGINES:
+            raise ValueError(f"Unknown Excel engine: {engine}")
+        if engine == "xlsxwriter" and xlsxwriter is None:
+            raise ValueError("The xlsxwriter engine requires the XlsxWriter package")
+        
+        if formatted is None:
+            formatted = ReportGenerator.format_results(results)
+        if engine == "openpyxl":
+            return ReportGenerator._generate_excel_openpyxl(results, formatted)
+        return ReportGenerator._generate_excel_xlsxwriter(results, formatted)
+    
+    @staticmethod
+    def _generate_excel_xlsxwriter(results: List[Dict[str, Any]], formatted: List[tuple]) -> bytes:
+        """Write the Excel report with XlsxWriter, which emits the sheet XML directly"""
+        excel_buffer = io.BytesIO()
+        # constant_memory flushes each row once the next one is started
+        wb = xlsxwriter.Workbook(excel_buffer, {'constant_memory': True})
+        ws = wb.add_worksheet("Performance Analysis")
+        
+        # Define styles; each format is registered with the workbook once
+        header_format = wb.add_format({
+            'bold': True,
+            'font_size': 12,
+            'font_color': '#FFFFFF',
+            'bg_color': f'#{ReportGenerator.HEADER_COLOR}',
+            'align': 'center',
+            'valign': 'vcenter',
+            'text_wrap': True,
+            'border': 1,
+        })
+        number_format = wb.add_format({'align': 'center', 'valign': 'top', 'border': 1})
+        cell_format = wb.add_format({'valign': 'top', 'text_wrap': True, 'border': 1})
+        
+        for col_num, (_, width) in enumerate(ReportGenerator.EXCEL_COLUMNS):
+            ws.set_column(col_num, col_num, width)
+        
+        # Freeze header row
+        ws.freeze_panes(1, 0)
+        
+        # Write headers
+        ws.write_row(0, 0, [header for header, _ in ReportGenerator.EXCEL_COLUMNS], header_format)
+        
+        # Write data
+        for row, (result, formatted_row) in enumerate(zip(results, formatted), 1):
+            status_text, evaluation_text, row_height = ReportGenerator._excel_row(formatted_row)
+            
+            ws.set_row(row, row_height)
+            ws.write_number(row, 0, row, number_format)
+            # Always written as strings: the evaluation text starts with "===", which
+            # write() would otherwise store as a (broken) formula
+            ws.write_string(row, 1, str(result["concept"]), cell_format)
+            # Example (empty for now - could be filled from original sheet)
+            ws.write_blank(row, 2, None, cell_format)
+            ws.write_string(row, 3, status_text, cell_format)
+            ws.write_string(row, 4, evaluation_text, cell_format)
+        
+        wb.close()
+        return excel_buffer.getvalue()
+    
+    @staticmethod
+    def _generate_excel_openpyxl(results: List[Dict[str, Any]], formatted: List[tuple]) -> bytes:
+        """Write the Excel report with openpyxl"""
+        # openpyxl is only the fallback writer, so it is imported on first use
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+        from openpyxl.utils import get_column_letter
+        
+        # Write-only mode streams each row out as it is appended instead of keeping
+        # every cell of the sheet alive as a full Cell object
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Performance Analysis")
+        
+        # Register each cell style with the workbook once; assigning a named style
+        # sets all of a cell's style attributes in one step
+        thin_border = Border(
             left=Side(style='thin'),
             right=Side(style='thin'),
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        header_color = ReportGenerator.HEADER_COLOR
+        for name, style in (
+            ("Report Header", dict(
+                font=Font(bold=True, size=12, color="FFFFFF"),
+                fill=PatternFill(start_color=header_color, end_color=header_color, fill_type="solid"),
+                alignment=Alignment(horizontal="center", vertical="center", wrap_text=True)
+            )),
+            ("Report Number", dict(alignment=Alignment(horizontal="center", vertical="top"))),
+            ("Report Text", dict(alignment=Alignment(vertical="top", wrap_text=True))),
+        ):
+            wb.add_named_style(NamedStyle(name=name, border=thin_border, **style))
+        
+        def styled_cell(value, style):
+            cell = WriteOnlyCell(ws, value=value)
+            if isinstance(value, str):
+                # Text starting with "=" must not be stored as a formula
+                cell.data_type = 's'
+            cell.style = style
+            return cell
+        
+        # Set column widths; these and the frozen header must be set before any row is written
+        for col_num, (_, width) in enumerate(ReportGenerator.EXCEL_COLUMNS, 1):
+            ws.column_dimensions[get_column_letter(col_num)].width = width
         
-        # Set column widths
-        ws.column_dimensions['A'].width = 10
-        ws.column_dimensions['B'].width = 40
-        ws.column_dimensions['C'].width = 30
-        ws.column_dimensions['D'].width = 60
-        ws.column_dimensions['E'].width = 70
+        # Freeze header row
+        ws.freeze_panes = "A2"
         
         # Write headers
-        headers = ["Concept No.", "Concept (With Explanation)", "Example", "Status", "AI Evaluation Process"]
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = border
+        ws.append([styled_cell(header, "Report Header") for header, _ in ReportGenerator.EXCEL_COLUMNS])
         
         # Write data
-        for idx, result in enumerate(results, 2):
-            # Concept Number
-            cell = ws.cell(row=idx, column=1, value=idx-1)
-            cell.alignment = Alignment(horizontal="center", vertical="top")
-            cell.border = border
-            
-            # Concept Name
-            cell = ws.cell(row=idx, column=2, value=result["concept"])
-            cell.alignment = cell_alignment
-            cell.border = border
-            
-            # Example (empty for now - could be filled from original sheet)
-            cell = ws.cell(row=idx, column=3, value="")
-            cell.alignment = cell_alignment
-            cell.border = border
-            
-            # Status (Response 1 + Response 2)
-            response_1 = ReportGenerator._format_response_1(result)
-            response_2 = ReportGenerator._format_response_2(result)
-            status_text = f"{response_1}\n\n{response_2}"
-            
-            cell = ws.cell(row=idx, column=4, value=status_text)
-            cell.alignment = cell_alignment
-            cell.border = border
+        for idx, (result, formatted_row) in enumerate(zip(results, formatted), 2):
+            status_text, evaluation_text, row_height = ReportGenerator._excel_row(formatted_row)
             
-            # AI Evaluation Process
-            evaluation_text = ReportGenerator._format_evaluation_process(result)
-            cell = ws.cell(row=idx, column=5, value=evaluation_text)
-            cell.alignment = cell_alignment
-            cell.border = border
+            # Set row height based on content, before the row is written
+            ws.row_dimensions[idx].height = row_height
             
-            # Set row height based on content
-            total_lines = max(len(status_text.split('\n')), len(evaluation_text.split('\n')))
-            ws.row_dimensions[idx].height = max(60, total_lines * 15)
-        
-        # Freeze header row
-        ws.freeze_panes = "A2"
-        
-        # Save to bytes
+            ws.append([
+                # Concept Number
+                styled_cell(idx-1, "Report Number"),
+                # Concept Name
+                styled_cell(str(result["concept"]), "Report Text"),
+                # Example (empty for now - could be filled from original sheet)
+                styled_cell("", "Report Text"),
+                styled_cell(status_text, "Report Text"),
+                styled_cell(evaluation_text, "Report Text"),
+            ])
+        
+        # Save to bytes. BytesIO grows geometrically, so the zip writer's many small
+        # writes don't reallocate per write; getvalue() reads it without seeking.
         excel_buffer = io.BytesIO()
         wb.save(excel_buffer)
-        excel_buffer.seek(0)
-        
         return excel_buffer.getvalue()
     
     @staticmethod
-    def generate_pdf(results: List[Dict[str, Any]]) -> bytes:
+    def _excel_row(formatted_row: tuple) -> tuple:
+        """
+        Build the text columns of a result's Excel row
+        
+        Args:
+            formatted_row: The result's entry from format_results
+            
+        Returns:
+            Tuple of (status_text, evaluation_text, row_height)
+        """
+        response_1, response_2, evaluation_text = formatted_row
+        
+        # Status (Response 1 + Response 2)
+        status_text = f"{response_1}\n\n{response_2}"
+        
+        # Row height based on content
+        total_lines = max(status_text.count('\n'), evaluation_text.count('\n')) + 1
+        return status_text, evaluation_text, max(60, total_lines * 15)
+    
+    @staticmethod
+    def generate_pdf(results: List[Dict[str, Any]], formatted: Optional[List[tuple]] = None) -> bytearray:
         """
         Generate PDF report with formatted concept analysis
         
         Args:
             results: List of analysis results for each concept
+            formatted: Optional output of format_results(results), to reuse
             
         Returns:
-            PDF file as bytes
+            PDF file as a bytearray (bytes-like, accepted wherever bytes are)
         """
+        if formatted is None:
+            formatted = ReportGenerator.format_results(results)
+        
+        # Imported on first use, keeping fpdf2 out of the app's startup
+        from fpdf import FPDF
+        
         pdf = FPDF()
         pdf.set_margins(left=15, top=15, right=15)
         pdf.set_auto_page_break(auto=True, margin=15)
@@ -206,7 +326,7 @@ class ReportGenerator:
         
         # Summary statistics
         total_concepts = len(results)
-        tested_concepts = sum(1 for r in results if r["tested_count"] > 0)
+        tested_concepts = sum(r["tested_count"] > 0 for r in results)
         total_mistakes = sum(r["mistakes_count"] for r in results)
         
         pdf.set_font("Helvetica", "B", 12)
@@ -223,40 +343,36 @@ class ReportGenerator:
         pdf.cell(0, 10, "Detailed Analysis", ln=True)
         pdf.ln(5)
         
-        for idx, result in enumerate(results, 1):
+        # Bound once, as they are called several times per concept
+        set_font = pdf.set_font
+        cell = pdf.cell
+        sanitize = ReportGenerator.sanitize_for_pdf
+        write_text = ReportGenerator._write_pdf_text
+        
+        for idx, (result, (response_1, response_2, evaluation_text)) in enumerate(zip(results, formatted), 1):
             # Concept header
-            pdf.set_font("Helvetica", "B", 11)
+            set_font("Helvetica", "B", 11)
             pdf.set_fill_color(54, 96, 146)
             pdf.set_text_color(255, 255, 255)
-            concept_text = ReportGenerator.sanitize_for_pdf(f"{idx}. {result['concept']}")
-            pdf.cell(0, 8, concept_text, ln=True, fill=True)
+            # Sanitize the bare name, not the numbered header, so the memoized result is
+            # reused whenever the same concept appears again (e.g. the next student's report)
+            concept_text = f"{idx}. {sanitize(str(result['concept']))}"
+            cell(0, 8, concept_text, ln=True, fill=True)
             pdf.set_text_color(0, 0, 0)
             
-            # Response 1
-            pdf.set_font("Helvetica", "B", 10)
-            pdf.cell(0, 6, "Performance Summary:", ln=True)
-            pdf.set_font("Helvetica", "", 10)
-            response_1 = ReportGenerator._format_response_1(result)
-            response_1 = ReportGenerator.sanitize_for_pdf(response_1)
-            pdf.multi_cell(0, 5, response_1)
-            
-            # Response 2
+            # Sections as (label, text, font size, line height): Response 1 always,
+            # Response 2 when there are mistakes, and the AI evaluation process if any
+            sections = [("Performance Summary:", response_1, 10, 5)]
             if result["mistakes_count"] > 0:
-                pdf.set_font("Helvetica", "B", 10)
-                pdf.cell(0, 6, "Detailed Mistake Analysis:", ln=True)
-                pdf.set_font("Helvetica", "", 10)
-                response_2 = ReportGenerator._format_response_2(result)
-                response_2 = ReportGenerator.sanitize_for_pdf(response_2)
-                pdf.multi_cell(0, 5, response_2)
-            
-            # AI Evaluation Process
-            evaluation_text = ReportGenerator._format_evaluation_process(result)
+                sections.append(("Detailed Mistake Analysis:", response_2, 10, 5))
             if evaluation_text and evaluation_text != "No evaluation data available":
-                pdf.set_font("Helvetica", "B", 10)
-                pdf.cell(0, 6, "AI Evaluation Process:", ln=True)
-                pdf.set_font("Helvetica", "", 9)
-                evaluation_text = ReportGenerator.sanitize_for_pdf(evaluation_text)
-                pdf.multi_cell(0, 4, evaluation_text)
+                sections.append(("AI Evaluation Process:", evaluation_text, 9, 4))
+            
+            for label, text, font_size, line_height in sections:
+                set_font("Helvetica", "B", 10)
+                cell(0, 6, label, ln=True)
+                set_font("Helvetica", "", font_size)
+                write_text(pdf, line_height, sanitize(text))
             
             pdf.ln(5)
             
@@ -264,8 +380,48 @@ class ReportGenerator:
             if pdf.get_y() > 250:
                 pdf.add_page()
         
-        # Return PDF as bytes
-        return bytes(pdf.output())
+        # fpdf2 already returns a bytearray; converting it to bytes would copy the whole file
+        return pdf.output()
+    
+    @staticmethod
+    def _write_pdf_text(pdf: "FPDF", line_height: float, text: str) -> None:
+        """
+        Write a block of text at the left margin, wrapping long lines
+        
+        fpdf2's multi_cell re-measures the line so far for every character it
+        places, which dominates report generation for long evaluation text. Lines
+        that fit the page, nearly all of them in practice, are measured once and
+        written as a plain cell; only longer lines go through multi_cell.
+        """
+        max_width = pdf.epw - 2 * pdf.c_margin
+        for line in text.split("\n"):
+            if pdf.get_string_width(line) <= max_width:
+                pdf.cell(0, line_height, line, new_x="LMARGIN", new_y="NEXT")
+            else:
+                pdf.multi_cell(0, line_height, line, new_x="LMARGIN", new_y="NEXT")
+    
+    @staticmethod
+    def format_results(results: List[Dict[str, Any]]) -> List[tuple]:
+        """
+        Format the report text of every result once
+        
+        The Excel and PDF reports show the same text; format it with this and pass
+        it to both generators so each result is only formatted once.
+        
+        Args:
+            results: List of analysis results for each concept
+            
+        Returns:
+            One (response_1, response_2, evaluation_text) tuple per result
+        """
+        return [
+            (
+                ReportGenerator._format_response_1(result),
+                ReportGenerator._format_response_2(result),
+                ReportGenerator._format_evaluation_process(result),
+            )
+            for result in results
+        ]
     
     @staticmethod
     def _format_response_1(result: Dict[str, Any]) -> str:
@@ -303,6 +459,7 @@ class ReportGenerator:
         # Section 1: How questions were mapped to this concept
         concept_reasoning = result.get("concept_reasoning", [])
         if concept_reasoning:
+            concept = result["concept"]
             sections.append("=== QUESTION-TO-CONCEPT MAPPING ===")
             for reasoning in concept_reasoning:
                 q_num = reasoning.get("question", "?")
@@ -312,11 +469,14 @@ class ReportGenerator:
                 sections.append(f"\nQuestion {q_num} [{confidence} CONFIDENCE]:")
                 sections.append(f"  Summary: {summary}")
                 
-                # Show concept alignments
-                alignments = reasoning.get("concept_alignments", [])
-                for alignment in alignments:
-                    if alignment.get("concept") == result["concept"]:
-                        sections.append(f"  Rationale: {alignment.get('rationale', 'N/A')}")
+                # Show concept alignments. GeminiAnalyzer already keeps only this
+                # concept's alignments in concept_reasoning, so this is usually a
+                # single entry; the check covers results built elsewhere.
+                sections.extend(
+                    f"  Rationale: {alignment.get('rationale', 'N/A')}"
+                    for alignment in reasoning.get("concept_alignments", [])
+                    if alignment.get("concept") == concept
+                )
                 
                 # Show rejected concepts
                 rejected = reasoning.get("considered_but_rejected", [])
@@ -353,32 +513,65 @@ class ReportGenerator:
         return "\n".join(sections) if sections else "No evaluation data available"
     
     @staticmethod
-    def create_downloadable_excel(results: List[Dict[str, Any]], filename: str = "analysis_report.xlsx") -> tuple:
+    def create_downloadable_excel(
+        results: List[Dict[str, Any]],
+        filename: str = "analysis_report.xlsx",
+        formatted: Optional[List[tuple]] = None
+    ) -> tuple:
         """
         Create downloadable Excel file for Streamlit
         
         Args:
             results: Analysis results
             filename: Output filename
+            formatted: Optional output of format_results(results), to reuse
             
         Returns:
             Tuple of (file_bytes, filename)
         """
-        excel_bytes = ReportGenerator.generate_excel(results)
+        excel_bytes = ReportGenerator.generate_excel(results, formatted)
         return excel_bytes, filename
     
     @staticmethod
-    def create_downloadable_pdf(results: List[Dict[str, Any]], filename: str = "analysis_report.pdf") -> tuple:
+    def create_downloadable_pdf(
+        results: List[Dict[str, Any]],
+        filename: str = "analysis_report.pdf",
+        formatted: Optional[List[tuple]] = None
+    ) -> tuple:
         """
         Create downloadable PDF file for Streamlit
         
         Args:
             results: Analysis results
             filename: Output filename
+            formatted: Optional output of format_results(results), to reuse
             
         Returns:
             Tuple of (file_bytes, filename)
         """
-        pdf_bytes = ReportGenerator.generate_pdf(results)
+        pdf_bytes = ReportGenerator.generate_pdf(results, formatted)
         return pdf_bytes, filename
-
+    
+    @staticmethod
+    def create_downloadable_reports(
+        results: List[Dict[str, Any]],
+        excel_filename: str = "analysis_report.xlsx",
+        pdf_filename: str = "analysis_report.pdf"
+    ) -> tuple:
+        """
+        Create both downloadable files for Streamlit, formatting the results once
+        for the two of them
+        
+        Args:
+            results: Analysis results
+            excel_filename: Output filename of the Excel report
+            pdf_filename: Output filename of the PDF report
+            
+        Returns:
+            Tuple of ((excel_bytes, excel_filename), (pdf_bytes, pdf_filename))
+        """
+        formatted = ReportGenerator.format_results(results)
+        return (
+            ReportGenerator.create_downloadable_excel(results, excel_filename, formatted=formatted),
+            ReportGenerator.create_downloadable_pdf(results, pdf_filename, formatted=formatted),
+        )